@@ -0,0 +1,179 @@
+import csv
+import io
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from maze import Maze, CellIndex, MazeVisualizerPIL, MazeVisualizerSVG, generate_maze
+from metrics import maze_metrics
+from solver import shortest_path, longest_path
+from webrender import IMAGE_FORMATS, encode_image
+
+# Columns of the manifest, one row per maze
+MANIFEST_FIELDS = ("seed", "files", "width", "height", "cells", "dead_ends", "corridor_cells", "straight_cells",
+                   "turns", "three_way_junctions", "four_way_junctions", "corridors", "mean_corridor_length",
+                   "river_factor", "solution_length", "generate_ms", "solve_ms", "render_ms")
+
+
+class BatchOptions(NamedTuple):
+    """
+    Everything that is the same for all mazes of a batch. It is sent once to every worker process.
+    """
+    width: int
+    height: int
+    start: CellIndex = CellIndex(x=0, y=0)
+    mask: np.ndarray = None
+    components: object = "start"
+    algorithm: str = "backtracker"
+    cell_size: int = 5
+    line_width: int = 1
+    image_format: str = "png"
+    solution: str = None
+    compress_level: int = 6
+
+
+def _encode(maze: Maze, options: BatchOptions, path: np.ndarray = None) -> bytes:
+    if options.image_format == "svg":
+        return "".join(MazeVisualizerSVG(maze, options.cell_size, options.line_width).iter_svg(path=path)).encode()
+    visualizer = MazeVisualizerPIL(maze, options.cell_size, options.line_width)
+    visualizer.plot_walls(path=path)
+    return encode_image(visualizer.img, options.image_format, compress_level=options.compress_level, lossless=True,
+                        quality=80)
+
+
+_options = None
+
+
+def _init_worker(options: BatchOptions):
+    global _options
+    _options = options
+
+
+def _make_maze(seed: int) -> Tuple[List[Tuple[str, bytes]], dict]:
+    """
+    Generate, solve and render the maze of one seed with the options of the worker.
+
+    :return: Names and contents of the files of the maze, and its row of the manifest
+    """
+    options = _options
+    t0 = time.perf_counter()
+    maze = generate_maze(options.width, options.height, options.start, options.mask, algorithm=options.algorithm,
+                         seed=seed, components=options.components)
+    t1 = time.perf_counter()
+    path = longest_path(maze) if options.solution == "longest" else shortest_path(maze)
+    t2 = time.perf_counter()
+    files = [(f"maze-{seed}.{options.image_format}", _encode(maze, options))]
+    if options.solution is not None:
+        files.append((f"maze-{seed}-solution.{options.image_format}", _encode(maze, options, path)))
+    t3 = time.perf_counter()
+    record = {"seed": seed, "files": " ".join(name for name, _ in files), "width": maze.width,
+              "height": maze.height, **maze_metrics(maze, path),
+              "generate_ms": round((t1 - t0) * 1000, 3), "solve_ms": round((t2 - t1) * 1000, 3),
+              "render_ms": round((t3 - t2) * 1000, 3)}
+    return files, record
+
+
+class _DirectoryOutput:
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def add(self, name: str, data: bytes):
+        with open(os.path.join(self.path, name), "wb") as file:
+            file.write(data)
+
+    def close(self):
+        pass
+
+
+class _ZipOutput:
+    def __init__(self, path: str):
+        self.archive = zipfile.ZipFile(path, "w")
+
+    def add(self, name: str, data: bytes):
+        # PNG and WebP are compressed already
+        compression = zipfile.ZIP_DEFLATED if name.endswith((".svg", ".csv")) else zipfile.ZIP_STORED
+        self.archive.writestr(name, data, compress_type=compression)
+
+    def close(self):
+        self.archive.close()
+
+
+class _TarOutput:
+    def __init__(self, path: str):
+        compression = "gz" if path.lower().endswith((".tar.gz", ".tgz")) else ""
+        self.archive = tarfile.open(path, f"w:{compression}")
+        self.mtime = time.time()
+
+    def add(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+
+def _open_output(path: str):
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return _ZipOutput(path)
+    if lower.endswith((".tar", ".tar.gz", ".tgz")):
+        return _TarOutput(path)
+    return _DirectoryOutput(path)
+
+
+def generate_batch(seeds: Iterable[int], options: BatchOptions, output: str, workers: int = None,
+                   chunksize: int = None) -> List[dict]:
+    """
+    Generate and render one maze per seed on a process pool and write the images into a directory or archive as
+    they are finished, together with a manifest.csv listing the seed, files, statistics and timings of every maze.
+    Workers receive the options once when they start and then only the seeds, in chunks, so the overhead per maze
+    is small compared to generating it.
+
+    :param seeds: Seeds of the mazes
+    :param options: Size, mask and rendering options shared by all mazes
+    :param output: Directory to write the files to, or the name of a .zip, .tar, .tar.gz or .tgz archive
+    :param workers: Number of worker processes, all cores by default. With 1 the mazes are generated in this process.
+    :param chunksize: Number of seeds sent to a worker at once, chosen from the number of seeds by default
+    :return: The rows of the manifest
+    """
+    if options.image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format {options.image_format}, expected one of {', '.join(IMAGE_FORMATS)}.")
+    seeds = list(seeds)
+    workers = workers or os.cpu_count()
+    if chunksize is None:
+        # A few chunks per worker keeps all of them busy until the end
+        chunksize = max(1, min(64, len(seeds) // (workers * 4)))
+    manifest = []
+    writer = _open_output(output)
+    try:
+        if workers == 1:
+            _init_worker(options)
+            results = map(_make_maze, seeds)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,))
+            results = executor.map(_make_maze, seeds, chunksize=chunksize)
+        try:
+            for files, record in results:
+                for name, data in files:
+                    writer.add(name, data)
+                manifest.append(record)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        table = io.StringIO()
+        csv_writer = csv.DictWriter(table, MANIFEST_FIELDS)
+        csv_writer.writeheader()
+        csv_writer.writerows(manifest)
+        writer.add("manifest.csv", table.getvalue().encode())
+    finally:
+        writer.close()
+    return manifest
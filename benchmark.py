@@ -0,0 +1,240 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, NamedTuple
+
+import numpy as np
+
+from maze import ALGORITHMS, MazeVisualizerPIL, MazeVisualizerSVG, generate_maze
+from create_mask_image import text_mask, _text_mask_array
+from solver import shortest_path
+
+# Offline benchmarks of the stages of generating and serving a maze. Every case is run a number of times to measure
+# the time, and once more with tracemalloc to measure the peak memory, since tracing slows down allocations.
+
+STAGES = ("generate", "mask", "render", "solve", "text", "http")
+# Characters repeated to build texts of a given length, the letters are connected in the Unicorn font
+_TEXT = "mazemaker"
+
+
+class Case(NamedTuple):
+    """
+    A single benchmark. setup runs before every repetition and is not measured, its result is passed to run.
+    pooled returns whether the work is done in the process pool of the web app, where tracemalloc can't measure it.
+    """
+    stage: str
+    name: str
+    run: Callable
+    setup: Callable = lambda: None
+    pooled: Callable = lambda: False
+
+    @property
+    def id(self) -> str:
+        return f"{self.stage}/{self.name}"
+
+
+def _random_mask(size: int, density: float, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((size, size)) < density
+
+
+def _load_flask_app():
+    # The module name contains a dash, so it can't be imported with an import statement
+    spec = importlib.util.spec_from_file_location("flask_app", os.path.join(os.path.dirname(__file__), "flask-app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def cases(args) -> Iterator[Case]:
+    """
+    Create the benchmark cases for the parameters given on the command line.
+    """
+    for size in args.sizes:
+        for algorithm in args.algorithms:
+            yield Case("generate", f"{algorithm}-{size}",
+                       lambda algorithm=algorithm, size=size: generate_maze(size, size, algorithm=algorithm, seed=1))
+
+    for size in args.sizes:
+        for density in args.densities:
+            yield Case("mask", f"density{density}-{size}",
+                       lambda mask, size=size: generate_maze(size, size, mask=mask, seed=1, components="all"),
+                       lambda size=size, density=density: _random_mask(size, density))
+
+    size = args.render_size
+    maze = None
+
+    def rendered_maze():
+        nonlocal maze
+        if maze is None:
+            maze = generate_maze(size, size, seed=1)
+        return maze
+
+    for cell_size in args.cell_sizes:
+        line_width = max(1, cell_size // 5)
+        yield Case("render", f"png-{size}-cell{cell_size}",
+                   lambda maze, cell_size=cell_size, line_width=line_width: MazeVisualizerPIL(
+                       maze, cell_size, line_width).plot_walls(),
+                   rendered_maze)
+        yield Case("render", f"svg-{size}-cell{cell_size}",
+                   lambda maze, cell_size=cell_size, line_width=line_width: "".join(
+                       MazeVisualizerSVG(maze, cell_size, line_width).iter_svg()),
+                   rendered_maze)
+
+    for size in args.sizes:
+        yield Case("solve", f"shortest-{size}", shortest_path, lambda size=size: generate_maze(size, size, seed=1))
+
+    for length in args.text_lengths:
+        text = (_TEXT * (length // len(_TEXT) + 1))[:length]
+        # Masks are cached, so the cache is cleared before every run
+        yield Case("text", f"length{length}", lambda text=text: text_mask(text, 32, 32), _text_mask_array.cache_clear)
+
+    flask_app = None
+
+    def client():
+        nonlocal flask_app
+        if flask_app is None:
+            flask_app = _load_flask_app()
+            flask_app.app.config["TESTING"] = True
+            # Filling the warm pool in the background would disturb the measurements
+            flask_app.app.config["WARM_POOL_SIZE"] = 0
+        return flask_app.app.test_client()
+
+    def get(url: str, fresh: bool = True):
+        def setup():
+            test_client = client()
+            if fresh:
+                # Render the response again in every run
+                flask_app.cache.clear()
+                _text_mask_array.cache_clear()
+            else:
+                test_client.get(f"{url}&seed=1")
+            return test_client, f"{url}&seed=1"
+
+        def run(request):
+            test_client, full_url = request
+            response = test_client.get(full_url)
+            assert response.status_code == 200, f"{full_url} returned {response.status_code}"
+            return response.data
+
+        def pooled():
+            client()
+            kind = url[1:url.index("?")]
+            with flask_app.app.test_request_context(url):
+                params = flask_app._admit(kind, flask_app.PARSERS[kind]())
+            return fresh and not flask_app._render_inline(kind, params)
+
+        return run, setup, pooled
+
+    for size in args.sizes:
+        if size * size <= args.http_max_cells:
+            yield Case("http", f"maze-{size}", *get(f"/maze?width={size}&height={size}&cell_size=5&wall_width=1"))
+            yield Case("http", f"maze-svg-{size}",
+                       *get(f"/maze?width={size}&height={size}&cell_size=5&wall_width=1&format=svg"))
+    yield Case("http", "maze-cached", *get("/maze?width=100&height=100", fresh=False))
+    for length in args.text_lengths:
+        text = (_TEXT * (length // len(_TEXT) + 1))[:length]
+        yield Case("http", f"masked_maze-length{length}", *get(f"/masked_maze?text={text}"))
+        yield Case("http", f"mask-length{length}", *get(f"/mask?text={text}"))
+
+
+def measure(case: Case, repeat: int) -> Dict[str, float]:
+    """
+    Run a case repeat times for the timings and once with tracemalloc for the peak memory.
+
+    :return: Median and minimum time in seconds and peak memory in bytes, None for cases running in the process pool
+    """
+    times = []
+    for _ in range(repeat):
+        argument = case.setup()
+        start = time.perf_counter()
+        case.run() if argument is None else case.run(argument)
+        times.append(time.perf_counter() - start)
+    peak = None
+    if not case.pooled():
+        argument = case.setup()
+        tracemalloc.start()
+        try:
+            case.run() if argument is None else case.run(argument)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"median_s": statistics.median(times), "min_s": min(times), "peak_bytes": peak}
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "system": platform.system(), "cpu_count": os.cpu_count()}
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Compare results with a baseline.
+
+    :param threshold: Ratio of the minimum time or peak memory to the baseline from which on a case regressed
+    :return: Ids of the cases that regressed
+    """
+    regressions = []
+    print(f"\n{'case':<40} {'time':>8} {'memory':>8}")
+    for case_id, result in results.items():
+        if case_id not in baseline:
+            continue
+        # The fastest run is disturbed least by other load on the machine
+        time_ratio = result["min_s"] / max(baseline[case_id]["min_s"], 1e-9)
+        memory_ratio = None
+        if result["peak_bytes"] is not None and baseline[case_id]["peak_bytes"] is not None:
+            memory_ratio = result["peak_bytes"] / max(baseline[case_id]["peak_bytes"], 1)
+        regressed = time_ratio > threshold or (memory_ratio or 0) > threshold
+        if regressed:
+            regressions.append(case_id)
+        memory = "-" if memory_ratio is None else f"{memory_ratio:.2f}x"
+        print(f"{case_id:<40} {time_ratio:>7.2f}x {memory:>8}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark maze generation, rendering, masks and the web routes. "
+                                                 "Prints the median time and peak memory of every case.")
+    parser.add_argument("--stage", nargs="+", choices=STAGES, default=STAGES, help="Stages to benchmark.")
+    parser.add_argument("-k", "--filter", default="", help="Only run cases whose id contains this string.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of timed runs of every case.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 300, 1000], help="Width and height of the mazes in cells.")
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS), help="Generation algorithms.")
+    parser.add_argument("--densities", nargs="+", type=float, default=[0.6, 0.8, 0.95], help="Fraction of cells in random masks.")
+    parser.add_argument("--render-size", type=int, default=300, help="Width and height in cells of the rendered maze.")
+    parser.add_argument("--cell-sizes", nargs="+", type=int, default=[2, 5, 20], help="Cell sizes in pixels for rendering.")
+    parser.add_argument("--text-lengths", nargs="+", type=int, default=[5, 20, 80], help="Number of characters of text masks.")
+    parser.add_argument("--http-max-cells", type=int, default=250_000, help="Largest maze requested from the web routes.")
+    parser.add_argument("--save", default=None, help="Store the results as baseline in this JSON file.")
+    parser.add_argument("--compare", default=None, help="Compare the results with the baseline in this JSON file and exit with status 1 on regressions.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Ratio to the baseline from which on a case counts as regression.")
+    args = parser.parse_args()
+    # Fonts are loaded relative to the repository
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    results = {}
+    print(f"{'case':<40} {'median':>10} {'min':>10} {'peak MiB':>10}")
+    for case in cases(args):
+        if case.stage not in args.stage or args.filter not in case.id:
+            continue
+        result = measure(case, args.repeat)
+        results[case.id] = result
+        peak = "-" if result["peak_bytes"] is None else f"{result['peak_bytes'] / 2 ** 20:.2f}"
+        print(f"{case.id:<40} {result['median_s'] * 1000:>8.1f}ms {result['min_s'] * 1000:>8.1f}ms {peak:>10}",
+              flush=True)
+
+    if args.save is not None:
+        with open(args.save, "w") as file:
+            json.dump({"environment": environment(), "results": results}, file, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline["environment"] != environment():
+            print("Warning: the baseline was measured in a different environment.", file=sys.stderr)
+        if compare(results, baseline["results"], args.threshold):
+            sys.exit(1)
@@ -1,4 +1,5 @@
 import argparse
+import functools
 import sys
 import enum
 import numpy as np
@@ -6,12 +7,34 @@ from typing import Tuple
 
 from PIL import Image, ImageDraw, ImageFont
 
+from timing import timed
+
 
 class Color(enum.IntEnum):
     white = 255
     black = 0
 
 
+# Number of fonts and finished text masks kept in memory
+FONT_CACHE_SIZE = 16
+MASK_CACHE_SIZE = 128
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+@timed("font")
+def _load_font(fontsize: int) -> ImageFont.FreeTypeFont:
+    """
+    Load the Unicorn font in the given size. Fonts are cached, since loading them is slow.
+    :param fontsize: Font size to load
+    :return: PIL.ImageFont instance
+    """
+    try:
+        # TODO add option to load other font
+        return ImageFont.truetype("fonts/Unicorn.ttf", size=fontsize)
+    except IOError:
+        sys.exit("Please place Unicorn.ttf, containing the Unicorn font made by Nick Curtis in the fonts folder.")
+
+
 def _create_fitting_image(text: str, font: ImageFont.ImageFont, bordersize: int, fill_color: Color = Color.white) -> Image.Image:
     """
     Create an image that fits the given text.
@@ -22,19 +45,16 @@ def _create_fitting_image(text: str, font: ImageFont.ImageFont, bordersize: int,
     :return: PIL.Image instance large enough to fit text on it with a distance border_size to the border of the image
     in every direction
     """
-    img_size = (1, 1)
-    img = Image.new("L", img_size, color=fill_color)
-    draw = ImageDraw.Draw(img)
-    left, top, right, bottom = draw.textbbox((0, 0), text, font)
+    left, top, right, bottom = font.getbbox(text)
     textwidth, textheight = right - left, bottom - top
     img_size = (textwidth + 2 * bordersize, textheight + 2 * bordersize)
-    img = img.resize(img_size)
-    return img
+    return Image.new("L", img_size, color=fill_color)
 
 
 def _draw_text_outline(img: Image.Image, font: ImageFont.ImageFont, text: str, fill_color: Color, line_color: Color, origin: Tuple[int, int]) -> None:
     """
     Draw text on image with an outline around the text.
+    The text is rasterized once and the outline is found by dilating the text pixels by one pixel in x and y.
     :param img: PIL.Image instance on which to draw
     :param font: PIL.ImageFont to use for drawing the text
     :param text: String to draw on image
@@ -42,27 +62,53 @@ def _draw_text_outline(img: Image.Image, font: ImageFont.ImageFont, text: str, f
     :param line_color: Color of the outline
     :param origin: (xy) coordinate tuple where the top left point of the text bounding box should be placed
     """
-    draw = ImageDraw.Draw(img)
-    # set to render text unaliased (https://mail.python.org/pipermail/image-sig/2005-August/003497.html)
-    draw.fontmode = "1"
     # correct for font offset
     x_offset, y_offset, _, _ = font.getbbox(text)
     # These values were tweaked by hand to get a better centered text
     x, y = (origin[0]-2*x_offset, origin[1]-y_offset//2)
-    origin = (x, y)
-    # draw border
-    draw.text((x - 1, y), text, font=font, fill=line_color)
-    draw.text((x + 1, y), text, font=font, fill=line_color)
-    draw.text((x, y - 1), text, font=font, fill=line_color)
-    draw.text((x, y + 1), text, font=font, fill=line_color)
-    # draw text over it
-    draw.text(origin, text, font=font, fill=fill_color)
+    # Rasterize with a margin of one pixel, so text pixels just outside of the image still create an outline
+    text_img = Image.new("1", (img.width + 2, img.height + 2), color=0)
+    draw = ImageDraw.Draw(text_img)
+    # set to render text unaliased (https://mail.python.org/pipermail/image-sig/2005-August/003497.html)
+    draw.fontmode = "1"
+    draw.text((x + 1, y + 1), text, font=font, fill=1)
+    text_pixels = np.asarray(text_img, dtype=bool)
+    outline = np.zeros_like(text_pixels)
+    outline[1:, :] |= text_pixels[:-1, :]
+    outline[:-1, :] |= text_pixels[1:, :]
+    outline[:, 1:] |= text_pixels[:, :-1]
+    outline[:, :-1] |= text_pixels[:, 1:]
+    pixels = np.array(img)
+    pixels[outline[1:-1, 1:-1]] = line_color
+    pixels[text_pixels[1:-1, 1:-1]] = fill_color
+    img.paste(Image.fromarray(pixels, mode="L"))
+
+
+@functools.lru_cache(maxsize=MASK_CACHE_SIZE)
+@timed("text_mask")
+def _text_mask_array(text: str, fontsize: int, bordersize: int, invert: bool) -> np.ndarray:
+    """
+    Create the pixels of a text mask. Results are cached and returned as read only array.
+    """
+    if invert:
+        fill_color = Color.black
+        line_color = Color.white
+    else:
+        fill_color = Color.white
+        line_color = Color.black
+    font = _load_font(fontsize)
+    img = _create_fitting_image(text, font, bordersize)
+    _draw_text_outline(img, font, text, fill_color, line_color, origin=(bordersize, bordersize))
+    pixels = np.asarray(img)
+    pixels.flags.writeable = False
+    return pixels
 
 
 def text_mask(text: str, fontsize: int, bordersize: int = 32, invert: bool = False) -> Image.Image:
     """
     Create mask image from text. A mask image is used during maze creation to mark areas where the algorithm
     won't go. Black pixels mark cells the algorithm won't move into, i.e. the represent walls.
+    Masks are cached, so repeated calls with the same arguments are cheap.
     :param text: String to draw on image. Image will be created with the correct size to fit the text.
     :param fontsize: Font size to use for the text.
     :param bordersize: Thickness of space around the text bounding box to the image border in pixels.
@@ -71,21 +117,8 @@ def text_mask(text: str, fontsize: int, bordersize: int = 32, invert: bool = Fal
     If true, the letters will be full black and the maze can be generated around the text.
     :return: PIL.Image instance with the text drawn as specified.
     """
-    text = text.lower()
-    if invert:
-        fill_color = Color.black
-        line_color = Color.white
-    else:
-        fill_color = Color.white
-        line_color = Color.black
-    try:
-        # TODO add option to load other font
-        font = ImageFont.truetype("fonts/Unicorn.ttf", size=fontsize)
-    except IOError:
-        sys.exit("Please place Unicorn.ttf, containing the Unicorn font made by Nick Curtis in the fonts folder.")
-    img = _create_fitting_image(text, font, bordersize)
-    _draw_text_outline(img, font, text, fill_color, line_color, origin=(bordersize, bordersize))
-    return img
+    pixels = _text_mask_array(text.lower(), fontsize, bordersize, invert)
+    return Image.fromarray(pixels.copy(), mode="L")
 
 
 def text_mask_to_boolarray(img: Image, invert: bool = False):
@@ -95,15 +128,27 @@ def text_mask_to_boolarray(img: Image, invert: bool = False):
     return bool_mask
 
 
-def find_start(img: Image):
-    x, y = 0, int(img.height / 2)
-    # Go right until the outline is hit
-    while img.getpixel((x, y)) == Color.white:
-        x += 1
-    # Go over the outline into the text
-    while img.getpixel((x, y)) == Color.black:
-        x += 1
-    return x, y
+def image_to_mask(img: Image.Image, width: int = None, height: int = None, threshold: int = 128) -> np.ndarray:
+    """
+    Convert a mask image to a bool mask with one entry per maze cell. The image is scaled to the cell grid by
+    averaging the pixels covered by every cell, then cells at least as bright as the threshold are allowed.
+    :param img: Mask image in any mode, white areas become part of the maze
+    :param width: Width of the cell grid. If only one of width and height is given, the other one keeps the aspect
+    ratio of the image. By default every pixel becomes a cell.
+    :param height: Height of the cell grid
+    :param threshold: Brightness from 0 to 255 from which on a cell is allowed
+    :return: Bool array with shape (height, width)
+    """
+    img = img.convert("L")
+    if width is None and height is None:
+        width, height = img.size
+    elif width is None:
+        width = max(1, round(img.width * height / img.height))
+    elif height is None:
+        height = max(1, round(img.height * width / img.width))
+    if (width, height) != img.size:
+        img = img.resize((width, height), Image.BOX)
+    return np.asarray(img) >= threshold
 
 
 def save_image_to_disk(image: Image.Image, filename: str) -> None:
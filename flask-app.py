@@ -1,60 +1,954 @@
-from flask import Flask, send_file, request, render_template
-import io
-from maze import generate_maze, MazeVisualizerPIL, CellIndex, masked_maze
-from create_mask_image import text_mask
-from PIL import Image, ImageColor
+from flask import Flask, request, render_template, abort, Response, stream_with_context, redirect, url_for, jsonify, g
+import functools
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from typing import Iterator, Optional, Tuple
+from maze import MazeVisualizerPIL, MazeVisualizerSVG, ALGORITHMS, letter_mask
+from metrics import SCORES
+from webrender import (IMAGE_FORMATS, best_candidate_seed, build_maze, encode_image, render, render_timed, run_job,
+                       solution_path)
+from tiles import load_info, open_tiled_maze
+import timing
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask("mazemaker")
+# Default encoder settings, can be overridden per request with the compress_level and lossless query parameters
+app.config.setdefault("PNG_COMPRESS_LEVEL", 6)
+app.config.setdefault("WEBP_LOSSLESS", True)
+app.config.setdefault("WEBP_QUALITY", 80)
+# Size of the in-process cache of encoded images in bytes
+app.config.setdefault("CACHE_MAX_BYTES", 64 * 1024 * 1024)
+# Seeded responses never change, so they can be cached by browsers and nginx for a long time
+app.config.setdefault("CACHE_MAX_AGE", 365 * 24 * 60 * 60)
+# Redirect requests without seed to the same URL with a random seed, which makes the response cacheable
+app.config.setdefault("REDIRECT_UNSEEDED", True)
+# Changing this invalidates all ETags, e.g. after changes to generation or rendering
+app.config.setdefault("CACHE_VERSION", "3")
+# Requests with up to this many cells and image pixels are rendered in the web worker itself. A few cells can still
+# make a large image with a large cell_size.
+app.config.setdefault("SYNC_MAX_CELLS", 250_000)
+app.config.setdefault("SYNC_MAX_PIXELS", 4_000_000)
+# Larger requests are rendered in a process pool and have to finish within POOL_TIMEOUT seconds. The request gives
+# up after the timeout, but rendering that already started runs to the end and keeps its place in the pool. Its
+# result is cached, so a retry is answered from the cache.
+app.config.setdefault("POOL_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+app.config.setdefault("POOL_TIMEOUT", 10)
+app.config.setdefault("POOL_MAX_PENDING", 8)
+# Requests with more cells are only accepted as asynchronous job, see /jobs
+app.config.setdefault("ASYNC_MIN_CELLS", 2_000_000)
+# Directory where job results are stored, shared by all web workers
+app.config.setdefault("JOB_DIR", os.path.join(tempfile.gettempdir(), "mazemaker-jobs"))
+# Size of JOB_DIR in bytes. The oldest jobs are removed when a new one would exceed it.
+app.config.setdefault("JOB_DIR_MAX_BYTES", 1024 * 1024 * 1024)
+# Budget of a single request. Requests above it are rejected with 413 before any work is done.
+app.config.setdefault("MAX_CELLS", 4_000_000)
+app.config.setdefault("MAX_PIXELS", 64_000_000)
+app.config.setdefault("MAX_BYTES", 512 * 1024 * 1024)
+app.config.setdefault("MAX_FONTSIZE", 1000)
+# Largest number of candidates of best_of requests. All candidates together may have at most MAX_CELLS cells.
+app.config.setdefault("BEST_OF_MAX", 16)
+# Reduce cell_size and wall_width of raster images until they fit into MAX_PIXELS instead of rejecting them
+app.config.setdefault("DOWNGRADE_OVERSIZED", True)
+# Number of requests a single client may have running in the process pool at the same time
+app.config.setdefault("MAX_POOL_REQUESTS_PER_CLIENT", 2)
+# Number of reverse proxies in front of the app, like nginx in the docker setup. The client address is taken from
+# the X-Forwarded-For header they set, otherwise all clients would share the address of the proxy. Set to 0 if the
+# app is reachable directly, since clients could send any address in the header then.
+app.config.setdefault("TRUSTED_PROXIES", 1)
+# Number of ready rendered mazes kept for each of the WARM_POOL_SETS, 0 disables the pool
+app.config.setdefault("WARM_POOL_SIZE", 8)
+# Route and query string of frequently requested parameters, the defaults of the web page. Unseeded requests with
+# these parameters are answered from the warm pool.
+app.config.setdefault("WARM_POOL_SETS", [
+    ("maze", "width=32&height=32"),
+    ("masked_maze", "text=example&fontsize=32&bordersize=16&cell_size=5&wall_width=1&all_components=1"),
+])
+# Directory shared by all workers, in which mazes for the tile routes are saved
+app.config.setdefault("TILE_DIR", os.path.join(tempfile.gettempdir(), "mazemaker-tiles"))
+# Largest maze that can be viewed in tiles, the cost of a tile does not depend on the size of the maze. Generating
+# the maze has to fit into MAX_BYTES as well.
+app.config.setdefault("TILE_MAX_CELLS", 16_000_000)
+# Cell size and wall width in pixels at the highest zoom level, the cell size has to be a power of two
+app.config.setdefault("TILE_CELL_SIZE", 16)
+app.config.setdefault("TILE_LINE_WIDTH", 2)
+app.config.setdefault("TILE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+# Size of TILE_DIR in bytes. The oldest saved mazes are removed when a new one would exceed it.
+app.config.setdefault("TILE_DIR_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+# Directory shared by all workers, in which every process stores its timing histograms for /metrics
+app.config.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "mazemaker-metrics"))
+# Allow profile=1 on the image routes, which answers with a sampling profile of rendering the image instead
+app.config.setdefault("PROFILING", False)
+app.config.setdefault("PROFILE_INTERVAL", 0.001)
+
+timing.enable_metrics(app.config["METRICS_DIR"])
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"], x_proto=app.config["TRUSTED_PROXIES"])
+
+
+class ResponseCache:
+    """
+    Thread safe LRU cache of encoded responses, bounded by the total size of the cached data.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, data: bytes, mimetype: str):
+        # Entries that would take up a large part of the cache are not worth evicting everything else for
+        if len(data) > self.max_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (data, mimetype)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+cache = ResponseCache(app.config["CACHE_MAX_BYTES"])
+tile_cache = ResponseCache(app.config["TILE_CACHE_MAX_BYTES"])
+
+
+class ClientLimiter:
+    """
+    Thread safe count of the running requests of every client.
+    """
+
+    def __init__(self):
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client: str, limit: int) -> bool:
+        """
+        Register a request of the client if it has less than limit requests running.
+
+        :return: True if the request may run, it has to be released afterwards
+        """
+        with self._lock:
+            running = self._running.get(client, 0)
+            if running >= limit:
+                return False
+            self._running[client] = running + 1
+            return True
+
+    def release(self, client: str):
+        with self._lock:
+            self._running[client] -= 1
+            if not self._running[client]:
+                del self._running[client]
+
+
+limiter = ClientLimiter()
+
+
+class WarmPool:
+    """
+    Ready rendered random mazes for frequently requested parameters, so unseeded requests for them don't wait for
+    the maze to be generated. A background thread fills the pool when the worker starts answering requests and
+    refills it while the worker is idle, one maze at a time in the process pool.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._params = {}
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def start(self, size: int, hot_sets: list):
+        """
+        Start filling the pool in this process, unless it is running already.
+
+        :param size: Number of mazes kept per parameter set
+        :param hot_sets: Route and query string of every parameter set
+        """
+        with self._lock:
+            if self._pid == os.getpid() or not size:
+                return
+            self._pid = os.getpid()
+        self.size = size
+        for kind, query_string in hot_sets:
+            # Parse the parameters like a request would, so they compare equal to the parameters of requests
+            with app.test_request_context(query_string=query_string):
+                params = _admit(kind, PARSERS[kind]())
+            key = _cache_key(kind, params)
+            self._params[key] = (kind, params)
+            self._entries[key] = deque()
+        threading.Thread(target=self._fill, daemon=True).start()
+
+    def take(self, kind: str, params: dict) -> Optional[Tuple[str, bytes]]:
+        """
+        Remove a maze rendered with the given unseeded parameters from the pool.
+
+        :return: Seed and encoded image of the maze, None if there is none
+        """
+        entries = self._entries.get(_cache_key(kind, params))
+        if entries is None:
+            return None
+        self._wakeup.set()
+        try:
+            return entries.popleft()
+        except IndexError:
+            return None
+
+    def request_started(self):
+        with self._lock:
+            self._active += 1
+
+    def request_finished(self):
+        with self._lock:
+            self._active -= 1
+
+    def _fill(self):
+        while True:
+            self._wakeup.clear()
+            missing = [key for key, entries in self._entries.items() if len(entries) < self.size]
+            if not missing:
+                self._wakeup.wait()
+            elif self._active:
+                # Rendering would slow down the requests of this worker
+                time.sleep(0.05)
+            else:
+                key = min(missing, key=lambda k: len(self._entries[k]))
+                kind, params = self._params[key]
+                seed = str(secrets.randbelow(2 ** 63))
+                try:
+                    # Rendered in the process pool, so requests of this worker don't wait for the GIL meanwhile
+                    data = _get_executor().submit(render, kind, {**params, 'seed': seed}).result()
+                    self._entries[key].append((seed, data))
+                except Exception:
+                    app.logger.exception("Filling the warm pool failed.")
+                    return
+
+
+warm_pool = WarmPool()
+
+
+@app.before_request
+def start_timing():
+    g.timing_token = timing.start_request()
+    g.request_start = time.perf_counter()
+    warm_pool.start(app.config["WARM_POOL_SIZE"], app.config["WARM_POOL_SETS"])
+    warm_pool.request_started()
+    g.warm_pool_active = True
+
+
+@app.after_request
+def add_server_timing(response):
+    total = time.perf_counter() - g.request_start
+    timing.observe("mazemaker_request_seconds", total, route=request.endpoint or "unknown")
+    response.headers['Server-Timing'] = timing.server_timing(timing.request_timings(), total)
+    return response
+
+
+@app.teardown_request
+def end_timing(exception):
+    if 'timing_token' in g:
+        timing.end_request(g.pop('timing_token'))
+    if g.pop('warm_pool_active', False):
+        warm_pool.request_finished()
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(timing.collect_metrics(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+
+def _get_int(name: str, default: int, minimum: int = 1) -> int:
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        abort(400, f"{name} has to be an integer.")
+    if value < minimum:
+        abort(400, f"{name} has to be at least {minimum}.")
+    return value
+
+
+def _get_text():
+    text = request.args.get('text', 'example')
+    if not text.strip():
+        abort(400, "text may not be empty.")
+    return text
+
+
+@functools.lru_cache(maxsize=256)
+def _has_letters(text: str, fontsize: int, bordersize: int) -> bool:
+    try:
+        letter_mask(text, fontsize, bordersize)
+    except ValueError:
+        return False
+    return True
+
+
+def _get_algorithm():
+    algorithm = request.args.get('algorithm', 'backtracker')
+    if algorithm not in ALGORITHMS:
+        abort(400, f"Unknown algorithm {algorithm}, expected one of {', '.join(ALGORITHMS)}.")
+    return algorithm
+
+
+def _get_mode():
+    mode = request.args.get('mode', 'P')
+    if mode not in MazeVisualizerPIL.MODES:
+        abort(400, f"Unknown image mode {mode}, expected one of {', '.join(MazeVisualizerPIL.MODES)}.")
+    return mode
+
+
+def _get_format():
+    image_format = request.args.get('format', 'png').lower()
+    if image_format not in IMAGE_FORMATS:
+        abort(400, f"Unknown format {image_format}, expected one of {', '.join(IMAGE_FORMATS)}.")
+    return image_format
+
+
+def _get_solution():
+    solution = request.args.get('solution', '0')
+    if solution in ('0', 'false'):
+        return None
+    if solution in ('1', 'true', 'shortest'):
+        return 'shortest'
+    if solution == 'longest':
+        return 'longest'
+    abort(400, "solution has to be 0, 1 or longest.")
+
+
+def _best_of_args() -> dict:
+    """
+    Parse the query parameters selecting the best of several candidate mazes.
+    """
+    best_of = _get_int('best_of', 1)
+    if best_of > app.config["BEST_OF_MAX"]:
+        abort(413, f"best_of may be at most {app.config['BEST_OF_MAX']}.")
+    score = request.args.get('score', 'publishing')
+    if score not in SCORES:
+        abort(400, f"Unknown score {score}, expected one of {', '.join(SCORES)}.")
+    # The score does not matter for a single candidate, it is not part of the cache key then
+    return dict(best_of=best_of, score=score if best_of > 1 else 'publishing')
+
+
+def _output_args(vector: bool = True) -> dict:
+    """
+    Parse the query parameters selecting the image format and encoder settings.
+
+    :param vector: If False, SVG output is not allowed
+    """
+    image_format = _get_format()
+    if image_format == 'svg' and not vector:
+        abort(400, "SVG output is only available for mazes.")
+    compress_level = _get_int('compress_level', app.config["PNG_COMPRESS_LEVEL"], minimum=0)
+    if compress_level > 9:
+        abort(400, "compress_level has to be between 0 and 9.")
+    lossless = request.args.get('lossless', str(int(app.config["WEBP_LOSSLESS"]))) not in ('0', 'false')
+    return dict(image_format=image_format, mode=_get_mode(), compress_level=compress_level, lossless=lossless,
+                quality=app.config["WEBP_QUALITY"])
+
+
+def _stream_svg(kind: str, params: dict) -> Iterator[str]:
+    """
+    Generate the maze and yield its SVG document while it is produced.
+    """
+    maze = build_maze(kind, params)
+    path = solution_path(maze, params['solution'])
+    yield from MazeVisualizerSVG(maze, params['cell_size'], params['wall_width']).iter_svg(path=path)
+
+
+def _estimate_cells(kind: str, params: dict) -> int:
+    """
+    Estimate the number of maze cells of a request before doing any work. For text masks the size of the mask
+    is estimated from the font size.
+    """
+    if kind in ('maze', 'tiles'):
+        return params['width'] * params['height']
+    text_width = len(params['text']) * params['fontsize'] + 2 * params['bordersize']
+    text_height = 2 * params['fontsize'] + 2 * params['bordersize']
+    return text_width * text_height
+
+
+def _work_cells(kind: str, params: dict) -> int:
+    """
+    Estimate the number of maze cells generated for a request, including all candidates of best_of requests.
+    """
+    return _estimate_cells(kind, params) * params.get('best_of', 1)
+
+
+# Peak memory use per maze cell during generation and per pixel while rendering, measured with tracemalloc
+GENERATION_BYTES_PER_CELL = {"backtracker": 32, "binary_tree": 72, "sidewinder": 112, "kruskal": 400, "wilson": 136}
+RENDER_BYTES_PER_PIXEL = {"1": 2, "P": 2, "RGB": 4}
+SVG_BYTES_PER_CELL = 40
+# Peak memory use per cell while saving a maze for the tile routes
+TILE_SAVE_BYTES_PER_CELL = 18
+
+
+def _estimate_cost(kind: str, params: dict) -> Tuple[int, int, int]:
+    """
+    Estimate the cost of a request before doing any work.
+
+    :return: Number of maze cells, number of image pixels and peak memory use in bytes
+    """
+    cells = _estimate_cells(kind, params)
+    if kind == 'mask':
+        return cells, cells, cells * RENDER_BYTES_PER_PIXEL["RGB"]
+    generation = cells * GENERATION_BYTES_PER_CELL[params['algorithm']]
+    if kind == 'tiles':
+        # Tiles are rendered one at a time later
+        return cells, 0, generation + cells * TILE_SAVE_BYTES_PER_CELL
+    if params['image_format'] == 'svg':
+        return cells, 0, generation + cells * SVG_BYTES_PER_CELL
+    pixels = cells * params['cell_size'] ** 2
+    return cells, pixels, generation + pixels * RENDER_BYTES_PER_PIXEL[params['mode']]
+
+
+def _render_inline(kind: str, params: dict) -> bool:
+    """
+    Decide if a request is cheap enough to be rendered in the web worker itself instead of the process pool.
+    """
+    _, pixels, _ = _estimate_cost(kind, params)
+    return (_work_cells(kind, params) <= app.config["SYNC_MAX_CELLS"]
+            and pixels <= app.config["SYNC_MAX_PIXELS"])
+
+
+def _admit(kind: str, params: dict) -> dict:
+    """
+    Check the request against the configured budget. Raster images that are too large are plotted with a smaller
+    cell size if DOWNGRADE_OVERSIZED is set, everything else that exceeds the budget is rejected.
+
+    :return: The parameters to render with
+    """
+    if kind != 'maze' and params['fontsize'] > app.config["MAX_FONTSIZE"]:
+        abort(413, f"fontsize may be at most {app.config['MAX_FONTSIZE']}.")
+    if 'wall_width' in params and params['wall_width'] > params['cell_size']:
+        abort(400, "wall_width may not be larger than cell_size.")
+    cells, pixels, size = _estimate_cost(kind, params)
+    if cells > app.config["MAX_CELLS"]:
+        abort(413, f"The maze may have at most {app.config['MAX_CELLS']} cells.")
+    if _work_cells(kind, params) > app.config["MAX_CELLS"]:
+        abort(413, f"All best_of candidates together may have at most {app.config['MAX_CELLS']} cells.")
+    if kind != 'mask' and app.config["DOWNGRADE_OVERSIZED"]:
+        while (pixels > app.config["MAX_PIXELS"] or size > app.config["MAX_BYTES"]) and params['cell_size'] > 2:
+            cell_size = max(2, int(params['cell_size'] * min(1, (app.config["MAX_PIXELS"] / pixels) ** 0.5)))
+            if cell_size == params['cell_size']:
+                cell_size -= 1
+            wall_width = max(1, params['wall_width'] * cell_size // params['cell_size'])
+            params = dict(params, cell_size=cell_size, wall_width=wall_width)
+            cells, pixels, size = _estimate_cost(kind, params)
+    if pixels > app.config["MAX_PIXELS"]:
+        abort(413, f"The image may have at most {app.config['MAX_PIXELS']} pixels.")
+    if size > app.config["MAX_BYTES"]:
+        abort(413, "Rendering the image would need too much memory.")
+    # Checked last, since it creates the text mask. Characters the font does not have leave nothing to fill.
+    if kind == 'masked_maze' and not _has_letters(params['text'], params['fontsize'], params['bordersize']):
+        abort(400, f"The text {params['text']!r} has no letters to fill with a maze.")
+    return params
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending_jobs = threading.BoundedSemaphore(1)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    Return the process pool of this web worker. It is created on first use, so every gunicorn worker creates
+    its own pool after forking.
+    """
+    global _executor, _pending_jobs
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=app.config["POOL_WORKERS"])
+            _pending_jobs = threading.BoundedSemaphore(app.config["POOL_MAX_PENDING"])
+        return _executor
+
+
+def _reserve_pool() -> str:
+    """
+    Reserve room in the process pool for a request of the current client. Raises TooManyRequests if the client
+    already has too many requests running and ServiceUnavailable if too many requests are already waiting for the
+    pool.
+
+    :return: The client, to pass to limiter.release together with releasing _pending_jobs
+    """
+    client = request.remote_addr
+    if not limiter.acquire(client, app.config["MAX_POOL_REQUESTS_PER_CLIENT"]):
+        abort(Response("Too many large mazes requested at the same time, please try again later.", status=429,
+                       mimetype="text/plain", headers={"Retry-After": str(max(1, int(app.config["POOL_TIMEOUT"])))}))
+    if not _pending_jobs.acquire(blocking=False):
+        limiter.release(client)
+        abort(503, "Too many mazes are being generated, please try again later.")
+    return client
+
+
+def _pool_timeout():
+    abort(Response("Generating the maze took too long, please try again later or use the /jobs API.",
+                   status=503, mimetype="text/plain",
+                   headers={"Retry-After": str(max(1, int(app.config["POOL_TIMEOUT"])))}))
+
+
+def _best_seed(kind: str, params: dict) -> str:
+    """
+    Score the candidates of a best_of request in parallel in the process pool and return the seed of the best one.
+    """
+    executor = _get_executor()
+    client = _reserve_pool()
+    try:
+        return best_candidate_seed(kind, params, executor, timeout=app.config["POOL_TIMEOUT"])
+    except TimeoutError:
+        _pool_timeout()
+    finally:
+        _pending_jobs.release()
+        limiter.release(client)
+
+
+def _submit(kind: str, params: dict, result_path: str = None) -> Future:
+    """
+    Render in the process pool. Raises TooManyRequests if the client already has too many requests running and
+    ServiceUnavailable if too many requests are already waiting for the pool.
+
+    :return: Future of the result and the stage timings of the pool process, or of the result only for jobs
+    """
+    executor = _get_executor()
+    client = _reserve_pool()
+    if result_path is None:
+        future = executor.submit(render_timed, kind, params)
+    else:
+        future = executor.submit(run_job, kind, params, result_path)
+
+    def release(_):
+        _pending_jobs.release()
+        limiter.release(client)
+    future.add_done_callback(release)
+    return future
+
+
+def _render_bytes(kind: str, params: dict, key: Tuple) -> bytes:
+    """
+    Render small requests directly and larger ones in the process pool within the time budget.
+    """
+    if _render_inline(kind, params):
+        return render(kind, params)
+    if params.get('best_of', 1) > 1:
+        # Only the best candidate is rendered, the result is still cached under the key of the request
+        params = dict(params, seed=_best_seed(kind, params), best_of=1)
+    future = _submit(kind, params)
+    if key is not None:
+        # The result is cached even if this request gave up waiting, so a retry is answered from the cache
+        def cache_result(f: Future):
+            if not f.cancelled() and f.exception() is None:
+                cache.put(key, f.result()[0], IMAGE_FORMATS[params['image_format']])
+        future.add_done_callback(cache_result)
+    try:
+        with timing.stage("pool"):
+            data, timings = future.result(timeout=app.config["POOL_TIMEOUT"])
+    except TimeoutError:
+        future.cancel()
+        _pool_timeout()
+    timing.add_request_timings(timings)
+    return data
+
+
+def _cache_key(kind: str, params: dict) -> Tuple:
+    return (kind,) + tuple(sorted(params.items()))
+
+
+def _etag(key: Tuple) -> str:
+    # Output is fully determined by the parameters, so the ETag is known before anything is rendered
+    return hashlib.sha1(f"{app.config['CACHE_VERSION']}{key!r}".encode()).hexdigest()
+
+
+def _respond(kind: str, params: dict):
+    """
+    Send the image for the parameters. Seeded and deterministic requests are answered from the cache and carry an
+    ETag, unseeded requests are redirected to a seeded URL or rendered fresh. Unseeded requests for the parameters of
+    the warm pool get a maze from the pool, with its seeded URL as Content-Location.
+    """
+    mimetype = IMAGE_FORMATS[params['image_format']]
+    if 'seed' in params and params['seed'] is None:
+        warm = warm_pool.take(kind, params)
+        if warm is not None:
+            seed, data = warm
+            # Sent right away instead of redirecting, since the follow-up request usually reaches another web worker
+            # that would have to render the maze again. Content-Location is the seeded URL of the same maze.
+            key = _cache_key(kind, {**params, 'seed': seed})
+            cache.put(key, data, mimetype)
+            response = Response(data, mimetype=mimetype)
+            response.set_etag(_etag(key))
+            response.headers['Content-Location'] = url_for(request.endpoint, **request.args.to_dict(), seed=seed)
+        elif app.config["REDIRECT_UNSEEDED"]:
+            response = redirect(url_for(request.endpoint, **request.args.to_dict(), seed=secrets.randbelow(2 ** 63)))
+        elif params['image_format'] == 'svg' and _render_inline(kind, params):
+            response = Response(stream_with_context(_stream_svg(kind, params)), mimetype=mimetype)
+        else:
+            response = Response(_render_bytes(kind, params, None), mimetype=mimetype)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    key = _cache_key(kind, params)
+    etag = _etag(key)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        cached = cache.get(key)
+        if cached is None:
+            if _estimate_cells(kind, params) >= app.config["ASYNC_MIN_CELLS"]:
+                job = _submit_job(kind, params)
+                if job.status_code != 200:
+                    return job
+                # The job is done, its image is sent like a rendered one
+                with open(_job_path(job.get_json()["id"]), "rb") as file:
+                    cached = (file.read(), mimetype)
+            else:
+                cached = (_render_bytes(kind, params, key), mimetype)
+            cache.put(key, *cached)
+        response = Response(cached[0], mimetype=cached[1])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["CACHE_MAX_AGE"]
+    return response
+
+
+def _evict_oldest(directory: str, max_bytes: int, busy) -> bool:
+    """
+    Remove the oldest entries of a directory shared by all workers until its files take up at most max_bytes.
+    All files of an entry start with its id and a dot. Other workers may evict at the same time, files that are gone
+    already are skipped.
+
+    :param busy: Function returning True for the set of file names of an entry that is still being written, it is
+    not removed
+    :return: True if any entry was removed
+    """
+    names, sizes, mtimes = defaultdict(set), defaultdict(int), defaultdict(float)
+    try:
+        with os.scandir(directory) as files:
+            for file in files:
+                try:
+                    stat = file.stat()
+                except FileNotFoundError:
+                    continue
+                entry = file.name.split(".", 1)[0]
+                names[entry].add(file.name)
+                sizes[entry] += stat.st_size
+                mtimes[entry] = max(mtimes[entry], stat.st_mtime)
+    except FileNotFoundError:
+        return False
+    total = sum(sizes.values())
+    removed = False
+    for entry in sorted(names, key=mtimes.get):
+        if total <= max_bytes:
+            break
+        if busy(names[entry]):
+            continue
+        for name in names[entry]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+        total -= sizes[entry]
+        removed = True
+    return removed
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(app.config["JOB_DIR"], job_id)
+
+
+def _submit_job(kind: str, params: dict):
+    """
+    Start rendering in the background and answer with 202 Accepted and the URL of the job status.
+    Identical requests share one job, since the job id is derived from the parameters. If the job is done already,
+    the status with the URL of the result is sent with 200 OK. Failed jobs are started again.
+    """
+    if params.get('seed', '') is None:
+        params['seed'] = str(secrets.randbelow(2 ** 63))
+    job_id = _etag(_cache_key(kind, params))
+    path = _job_path(job_id)
+    if os.path.exists(path + ".error"):
+        for stale_path in (path + ".error", path + ".json"):
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+    if not (os.path.exists(path) or os.path.exists(path + ".json")):
+        _evict_oldest(app.config["JOB_DIR"], app.config["JOB_DIR_MAX_BYTES"], _job_busy)
+        os.makedirs(app.config["JOB_DIR"], exist_ok=True)
+        with open(path + ".json", "w") as file:
+            json.dump({"kind": kind, "params": params}, file)
+        try:
+            _submit(kind, params, path)
+        except HTTPException:
+            # The job was rejected, it must not be reported as pending
+            os.remove(path + ".json")
+            raise
+    info = _job_info(job_id)
+    if info["status"] == "done":
+        return jsonify(info)
+    response = jsonify(dict(info, url=url_for('job_status', job_id=job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+
+def _job_busy(names: set) -> bool:
+    # Pending jobs only have their parameters, finished ones also their result or error
+    return any(name.endswith(".tmp") for name in names) or all(name.endswith(".json") for name in names)
+
+
+def _job_info(job_id: str) -> dict:
+    # Job state is kept in files, so every web worker can answer for jobs submitted to another one
+    if not all(c in "0123456789abcdef" for c in job_id):
+        abort(404)
+    path = _job_path(job_id)
+    if os.path.exists(path):
+        return dict(id=job_id, status="done", url=url_for('job_result', job_id=job_id))
+    if os.path.exists(path + ".error"):
+        with open(path + ".error") as file:
+            return dict(id=job_id, status="failed", **json.load(file))
+    if os.path.exists(path + ".json"):
+        return dict(id=job_id, status="pending")
+    abort(404)
+
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """
+    Render a maze in the background. Accepts the same query parameters as the route of the same name.
+    """
+    if kind not in PARSERS:
+        abort(404)
+    return _submit_job(kind, _admit(kind, PARSERS[kind]()))
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    return jsonify(_job_info(job_id))
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    info = _job_info(job_id)
+    if info["status"] != "done":
+        return jsonify(info), 404 if info["status"] == "failed" else 409
+    with open(_job_path(job_id) + ".json") as file:
+        image_format = json.load(file)["params"]["image_format"]
+    with open(_job_path(job_id), "rb") as file:
+        response = Response(file.read(), mimetype=IMAGE_FORMATS[image_format])
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["CACHE_MAX_AGE"]
+    return response
+
+
+def _tiled_maze_busy(names: set) -> bool:
+    return any(name.endswith((".pending", ".tmp")) for name in names)
+
+
+def _check_maze_id(maze_id: str):
+    if not all(c in "0123456789abcdef" for c in maze_id):
+        abort(404)
+
+
+def _tile_response(maze_id: str):
+    """
+    Describe a saved maze, or answer with 202 Accepted while it is being generated.
+    """
+    try:
+        info = load_info(app.config["TILE_DIR"], maze_id)
+    except FileNotFoundError:
+        if not os.path.exists(os.path.join(app.config["TILE_DIR"], maze_id + ".pending")):
+            abort(404)
+        response = jsonify(id=maze_id, status="pending")
+        response.status_code = 202
+        response.headers['Location'] = url_for('tiled_maze_info', maze_id=maze_id)
+        response.headers['Retry-After'] = "1"
+        return response
+    return jsonify(dict(info, status="done", tiles=f"{request.script_root}/tiles/{maze_id}/{{z}}/{{x}}/{{y}}.png"))
+
+
+@app.route('/tiles')
+def create_tiled_maze():
+    """
+    Generate a maze to be viewed in tiles and describe it. The id of the maze is derived from the parameters, so
+    requesting the same parameters again returns the saved maze. Mazes that take longer than POOL_TIMEOUT are
+    answered with 202 Accepted and the URL at which the description appears when the maze is saved.
+    """
+    params = dict(
+        width=_get_int('width', 1000),
+        height=_get_int('height', 1000),
+        algorithm=_get_algorithm(),
+        seed=request.args.get('seed') or str(secrets.randbelow(2 ** 63)),
+        cell_size=app.config["TILE_CELL_SIZE"],
+        line_width=app.config["TILE_LINE_WIDTH"],
+    )
+    cells, _, size = _estimate_cost('tiles', params)
+    if cells > app.config["TILE_MAX_CELLS"]:
+        abort(413, f"Mazes in tiles can have at most {app.config['TILE_MAX_CELLS']} cells.")
+    if size > app.config["MAX_BYTES"]:
+        abort(413, "Generating the maze would need too much memory.")
+    maze_id = _etag(_cache_key('tiles', params))[:20]
+    path = os.path.join(app.config["TILE_DIR"], maze_id)
+    if not (os.path.exists(path + ".json") or os.path.exists(path + ".pending")):
+        if _evict_oldest(app.config["TILE_DIR"], app.config["TILE_DIR_MAX_BYTES"], _tiled_maze_busy):
+            # Opened mazes keep their removed files mapped, which frees their space only when they are closed
+            open_tiled_maze.cache_clear()
+        os.makedirs(app.config["TILE_DIR"], exist_ok=True)
+        # Marks the maze as being generated for all workers, so it is only generated once
+        open(path + ".pending", "w").close()
+        try:
+            future = _submit('tiles', dict(params, directory=app.config["TILE_DIR"], maze_id=maze_id))
+        except HTTPException:
+            # The maze was rejected, it must not be reported as pending
+            os.remove(path + ".pending")
+            raise
+
+        def done(f: Future):
+            os.remove(path + ".pending")
+        future.add_done_callback(done)
+        try:
+            with timing.stage("pool"):
+                _, timings = future.result(timeout=app.config["POOL_TIMEOUT"])
+            timing.add_request_timings(timings)
+        except TimeoutError:
+            pass
+    return _tile_response(maze_id)
+
+
+@app.route('/tiles/<maze_id>')
+def tiled_maze_info(maze_id):
+    _check_maze_id(maze_id)
+    return _tile_response(maze_id)
+
+
+@app.route('/tiles/<maze_id>/<int:z>/<int:x>/<int:y>.png')
+def tile(maze_id, z, x, y):
+    """
+    Render a 256 x 256 pixel tile of a maze saved by /tiles. Level 0 shows the whole maze, every level doubles the
+    size. Only the cells within the tile are rendered, so the cost does not depend on the size of the maze.
+    """
+    _check_maze_id(maze_id)
+    etag = f"{maze_id}-{z}-{x}-{y}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        key = (maze_id, z, x, y)
+        cached = tile_cache.get(key)
+        if cached is None:
+            try:
+                img = open_tiled_maze(app.config["TILE_DIR"], maze_id).tile(z, x, y)
+            except (FileNotFoundError, ValueError):
+                abort(404)
+            cached = (encode_image(img, 'png', app.config["PNG_COMPRESS_LEVEL"], True, 0), "image/png")
+            tile_cache.put(key, *cached)
+        response = Response(cached[0], mimetype=cached[1])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["CACHE_MAX_AGE"]
+    return response
+
+
+def _maze_params() -> dict:
+    return dict(
+        width=_get_int('width', 10),
+        height=_get_int('height', 10),
+        # Rendered directly at the final scale instead of resizing a smaller plot
+        cell_size=_get_int('cell_size', 20),
+        wall_width=_get_int('wall_width', 4),
+        algorithm=_get_algorithm(),
+        seed=request.args.get('seed'),
+        solution=_get_solution(),
+        **_best_of_args(),
+        **_output_args(),
+    )
+
+
+def _mask_params() -> dict:
+    return dict(
+        text=_get_text(),
+        fontsize=_get_int('fontsize', 32),
+        bordersize=_get_int('bordersize', 32, minimum=0),
+        **_output_args(vector=False),
+    )
+
+
+def _masked_maze_params() -> dict:
+    return dict(
+        text=_get_text(),
+        fontsize=_get_int('fontsize', 32),
+        bordersize=_get_int('bordersize', 32, minimum=0),
+        cell_size=_get_int('cell_size', 5),
+        wall_width=_get_int('wall_width', 1),
+        algorithm=_get_algorithm(),
+        all_components=request.args.get('all_components', '0') not in ('0', 'false'),
+        seed=request.args.get('seed'),
+        solution=_get_solution(),
+        **_best_of_args(),
+        **_output_args(),
+    )
+
+
+PARSERS = {'maze': _maze_params, 'mask': _mask_params, 'masked_maze': _masked_maze_params}
+
+
+def _profile(kind: str, params: dict):
+    """
+    Render the image in this thread under the sampling profiler and send the profile in the collapsed stack format
+    instead of the image.
+    """
+    with timing.SamplingProfiler(app.config["PROFILE_INTERVAL"]) as profiler:
+        render(kind, params)
+    response = Response(profiler.collapsed(), mimetype="text/plain")
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def _handle(kind: str):
+    params = _admit(kind, PARSERS[kind]())
+    if app.config["PROFILING"] and request.args.get('profile', '0') not in ('0', 'false'):
+        return _profile(kind, params)
+    return _respond(kind, params)
+
+
 @app.route('/maze')
 def maze():
-    width = int(request.args.get('width', 10))
-    height = int(request.args.get('height', 10))
-    maze = generate_maze(width, height)
-    vis = MazeVisualizerPIL(maze, 5, 1)
-    vis.plot_walls()
-    img = vis.img
-    img = img.resize((4 * img.size[0], 4 * img.size[1]), Image.Resampling.NEAREST)
-    img_io = io.BytesIO()
-    img.save(img_io, 'PNG', quality=70)
-    img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    return _handle('maze')
 
 
 @app.route('/mask')
 def mask():
-    text = request.args.get('text', 'example')
-    fontsize = int(request.args.get('fontsize', 32))
-    bordersize = int(request.args.get('bordersize', 32))
-
-    img = text_mask(text, fontsize, bordersize)
-    img_io = io.BytesIO()
-    img.save(img_io, 'PNG')
-    img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    return _handle('mask')
 
 
 @app.route('/masked_maze')
 def masked_maze_route():
-    text = request.args.get('text', 'example')
-    fontsize = int(request.args.get('fontsize', 32))
-    bordersize = int(request.args.get('bordersize', 32))
-    cell_size = int(request.args.get('cell_size', 5))
-    wall_width = int(request.args.get('wall_width', 1))
-
-    maze = masked_maze(text, fontsize, bordersize)
-    vis = MazeVisualizerPIL(maze, cell_size, wall_width)
-    vis.plot_walls()
-    img = vis.img
-    img_io = io.BytesIO()
-    img.save(img_io, 'PNG', quality=70)
-    img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    return _handle('masked_maze')
 
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0")
\ No newline at end of file
+    app.run(host="0.0.0.0")
@@ -1,15 +1,19 @@
 import argparse
 import enum
+import functools
 import itertools
 import sys
+import time
 from collections import namedtuple
-from random import choice, seed
-from typing import List
+import hashlib
+import random
+from typing import Iterable, Iterator, List, Tuple, Union
 
 import numpy as np
 from PIL import Image, ImageDraw, ImageColor
 
-from create_mask_image import text_mask, text_mask_to_boolarray, find_start
+from create_mask_image import text_mask, text_mask_to_boolarray, image_to_mask
+from timing import timed
 
 
 class Stack:
@@ -50,13 +54,52 @@ class CellIndex(namedtuple("Cell", ("x", "y"))):
         return self.x - other.x, self.y - other.y
 
 
+class Wall(enum.IntFlag):
+    """
+    Bits of the wall bitmask stored per cell. The bit of a wall is 1 << Direction.
+    """
+    N = 1 << Direction.N
+    E = 1 << Direction.E
+    S = 1 << Direction.S
+    W = 1 << Direction.W
+
+
+ALL_WALLS = Wall.N | Wall.E | Wall.S | Wall.W
+
+
 class Cell:
-    def __init__(self):
-        self.visited = False
-        self.walls = [True] * 4
+    """
+    View of a single cell of a Maze. It reads from and writes to the arrays of the maze,
+    so it does not hold any state of its own.
+    """
+
+    def __init__(self, maze, cell_index: CellIndex):
+        self._maze = maze
+        self._index = (cell_index.y, cell_index.x)
+
+    @property
+    def visited(self) -> bool:
+        return bool(self._maze.visited[self._index])
+
+    @visited.setter
+    def visited(self, value: bool):
+        self._maze.visited[self._index] = value
+
+    @property
+    def walls(self) -> Tuple[bool, ...]:
+        """
+        Whether the cell has a wall in each Direction. The tuple is a copy, assign all four walls or use
+        remove_wall to change them.
+        """
+        bits = int(self._maze.walls[self._index])
+        return tuple(bool(bits & (1 << direction)) for direction in Direction)
+
+    @walls.setter
+    def walls(self, walls: Iterable[bool]):
+        self._maze.walls[self._index] = sum(1 << direction for direction, wall in zip(Direction, walls) if wall)
 
     def remove_wall(self, direction):
-        self.walls[direction.value] = False
+        self._maze.walls[self._index] &= ~np.uint8(1 << direction)
 
     def __repr__(self):
         return f"Cell({self.walls}, visited={self.visited})"
@@ -74,11 +117,27 @@ class Maze:
         """
         self.width = int(width)
         self.height = int(height)
-        self.cell_grid = np.array([Cell() for _ in range(height * width)]).reshape((height, width))
-        if (mask is not None) and (mask.shape != (height, width)):
-            raise ValueError(f"Mask shape does not match maze dimensions. mask: {mask.shape}, maze: {(height, width)}")
+        # Wall bitmask per cell, see Wall for the meaning of the bits. All walls are set initially.
+        self.walls = np.full((self.height, self.width), ALL_WALLS, dtype=np.uint8)
+        self.visited = np.zeros((self.height, self.width), dtype=bool)
+        if (mask is not None) and (mask.shape != (self.height, self.width)):
+            raise ValueError(f"Mask shape does not match maze dimensions. mask: {mask.shape}, maze: {(self.height, self.width)}")
         self.mask = mask
         self.start_cell = None
+        # Seed the maze was generated with, None if it was not seeded
+        self.seed = None
+
+    @functools.cached_property
+    def cell_grid(self) -> np.ndarray:
+        """
+        Object array of Cell views with shape (height, width), created on first access.
+        Only kept for compatibility, since it creates one Python object per cell. Use the walls and visited
+        arrays directly instead.
+        """
+        grid = np.empty((self.height, self.width), dtype=object)
+        for y, x in itertools.product(range(self.height), range(self.width)):
+            grid[y, x] = Cell(self, CellIndex(x=x, y=y))
+        return grid
 
     def get_neighbour_cell_indices(self, cell_index: CellIndex) -> List[CellIndex]:
         """
@@ -109,7 +168,7 @@ class Maze:
         :return: A list of CellIndex objects representing the unvisited neighbour cells
         """
         neighbour_cell_indices = self.get_neighbour_cell_indices(cell_index)
-        unvisited_cells = [index for index in neighbour_cell_indices if self.get_cell(index).visited is False]
+        unvisited_cells = [index for index in neighbour_cell_indices if not self.visited[index.y, index.x]]
         # TODO inherit from Maze to implement masked maze and override this function
         # Do not use 'is True' since the returned value is a numpy.bool_ or a Python bool
         unvisited_cells = [index for index in unvisited_cells if self.get_mask(index) == True]
@@ -121,7 +180,7 @@ class Maze:
 
         :param cell_index: The index of the cell to set as visited
         """
-        self.get_cell(cell_index).visited = True
+        self.visited[cell_index.y, cell_index.x] = True
 
     def remove_walls(self, start_cell_index: CellIndex, end_cell_index: CellIndex):
         """
@@ -133,8 +192,8 @@ class Maze:
         """
         direction_to = Mapping.step_to_direction[end_cell_index - start_cell_index]
         direction_from = Mapping.step_to_direction[start_cell_index - end_cell_index]
-        self.get_cell(start_cell_index).remove_wall(direction_to)
-        self.get_cell(end_cell_index).remove_wall(direction_from)
+        self.walls[start_cell_index.y, start_cell_index.x] &= ~np.uint8(1 << direction_to)
+        self.walls[end_cell_index.y, end_cell_index.x] &= ~np.uint8(1 << direction_from)
 
     def move(self, start_cell_index: CellIndex, end_cell_index: CellIndex):
         """
@@ -149,12 +208,51 @@ class Maze:
 
     def get_cell(self, cell_index: CellIndex) -> Cell:
         """
-        Return the cell object at the given cell_index.
+        Return a view of the cell at the given cell_index.
 
         :param cell_index: The index of the cell to get
-        :return: The cell object at cell_index
+        :return: Cell view reading from the walls and visited arrays of the maze
+        """
+        return Cell(self, cell_index)
+
+    def get_walls(self, cell_index: CellIndex) -> int:
+        """
+        Return the wall bitmask of the cell at cell_index.
+
+        :param cell_index: The index of the cell to get the walls for
+        :return: Bitmask of the walls of the cell, see Wall
         """
-        return self.cell_grid[cell_index.y, cell_index.x]
+        return int(self.walls[cell_index.y, cell_index.x])
+
+    def allowed_directions(self) -> np.ndarray:
+        """
+        Return the bitmask of directions in which every cell has a neighbour within the grid that is allowed by
+        the mask. The bits are the same as in the walls array, see Wall.
+
+        :return: uint8 array with shape (height, width)
+        """
+        allowed = np.full((self.height, self.width), ALL_WALLS, dtype=np.uint8)
+        allowed[0, :] &= ~np.uint8(Wall.N)
+        allowed[-1, :] &= ~np.uint8(Wall.S)
+        allowed[:, 0] &= ~np.uint8(Wall.W)
+        allowed[:, -1] &= ~np.uint8(Wall.E)
+        if self.mask is not None:
+            blocked = ~np.asarray(self.mask, dtype=bool)
+            allowed[1:, :][blocked[:-1, :]] &= ~np.uint8(Wall.N)
+            allowed[:-1, :][blocked[1:, :]] &= ~np.uint8(Wall.S)
+            allowed[:, :-1][blocked[:, 1:]] &= ~np.uint8(Wall.E)
+            allowed[:, 1:][blocked[:, :-1]] &= ~np.uint8(Wall.W)
+        return allowed
+
+    def cells(self) -> np.ndarray:
+        """
+        Return which cells may become part of the maze.
+
+        :return: Bool array with shape (height, width), the mask or all True if no mask was set
+        """
+        if self.mask is not None:
+            return np.asarray(self.mask, dtype=bool)
+        return np.ones((self.height, self.width), dtype=bool)
 
     def get_mask(self, cell_index: CellIndex) -> bool:
         """
@@ -170,21 +268,129 @@ class Maze:
             return True
 
 
+# Palette indices of the arrays returned by render_maze_array
+BACKGROUND, WALL, START, SOLUTION = 0, 1, 2, 3
+
+
+def _draw_segments(canvas: np.ndarray, segments: np.ndarray, cell_size: int, first_line: int, offsets: range):
+    """
+    Draw wall segments along the lines of the cell grid into a pixel array.
+    Line i lies at pixel first_line + i * cell_size perpendicular to the second axis of canvas and its segment j
+    covers the pixels j * cell_size to (j + 1) * cell_size inclusive along it.
+
+    :param canvas: Bool pixel array, a transposed view can be passed to draw vertical lines
+    :param segments: Bool array of shape (lines, cells) marking which segments to draw
+    :param cell_size: Cell size in pixels
+    :param first_line: Pixel position of the first line
+    :param offsets: Pixel offsets perpendicular to the line that are covered by the line width
+    """
+    n_lines, n_cells = segments.shape
+    line = np.zeros((n_lines, canvas.shape[1]), dtype=bool)
+    line[:, :n_cells * cell_size] = np.repeat(segments, cell_size, axis=1)
+    # Both end points of a segment are part of it
+    line[:, cell_size::cell_size] |= segments
+    positions = first_line + np.arange(n_lines) * cell_size
+    # The line width is drawn by dilating the one pixel wide lines perpendicular to their direction
+    for offset in offsets:
+        rows = positions + offset
+        inside = (rows >= 0) & (rows < canvas.shape[0])
+        canvas[rows[inside]] |= line[inside]
+
+
+def _draw_path(indices: np.ndarray, path: np.ndarray, width: int, cell_size: int, line_width: int):
+    """
+    Draw a line through the centers of the cells of a path with the palette index SOLUTION.
+
+    :param indices: Array of palette indices to draw into
+    :param path: Flat cell ids (y * width + x) of consecutive cells
+    :param width: Width of the maze in cells
+    :param cell_size: Cell size in pixels
+    :param line_width: Width of the line in pixels
+    """
+    y, x = np.divmod(np.asarray(path, dtype=np.int64), width)
+    center_y = y * cell_size + cell_size // 2
+    center_x = x * cell_size + cell_size // 2
+    # Every step covers the pixels from the center of a cell to the center of the next one
+    t = np.arange(cell_size + 1)
+    step_y = (center_y[:-1, None] + np.sign(np.diff(center_y))[:, None] * t).ravel()
+    step_x = (center_x[:-1, None] + np.sign(np.diff(center_x))[:, None] * t).ravel()
+    line_y = np.concatenate((center_y, step_y))
+    line_x = np.concatenate((center_x, step_x))
+    for offset_y, offset_x in itertools.product(range(-((line_width - 1) // 2), line_width // 2 + 1), repeat=2):
+        indices[line_y + offset_y, line_x + offset_x] = SOLUTION
+
+
+def render_maze_array(maze, cell_size_pixels: int, line_width_pixels: int, color_start_cell: bool = True,
+                      path: np.ndarray = None) -> np.ndarray:
+    """
+    Render the maze into an array of palette indices (BACKGROUND, WALL, START, SOLUTION) using array operations over
+    the whole grid. The result matches drawing every wall with ImageDraw.line.
+
+    :param maze: The Maze instance to render
+    :param cell_size_pixels: The size of each cell in pixels
+    :param line_width_pixels: The width of the walls in pixels
+    :param color_start_cell: If True, mark the inside of the start cell with START
+    :param path: Flat cell ids of a path through the maze, e.g. from solver.shortest_path, drawn with SOLUTION
+    :return: uint8 array with shape (height * cell_size_pixels + 1, width * cell_size_pixels + 1)
+    """
+    size = cell_size_pixels
+    height = maze.height * size + 1
+    width = maze.width * size + 1
+    walls = np.where(maze.visited, maze.walls, 0)
+    ink = np.zeros((height, width), dtype=bool)
+
+    # ImageDraw.line centers even line widths depending on the direction of the line. North walls are drawn left to
+    # right, south walls right to left and east and west walls top to bottom.
+    lower = (line_width_pixels - 1) // 2
+    upper = line_width_pixels // 2
+    _draw_segments(ink, walls & Wall.N != 0, size, 0, range(-lower, upper + 1))
+    _draw_segments(ink, walls & Wall.S != 0, size, size, range(-upper, lower + 1))
+    _draw_segments(ink.T, (walls & Wall.W != 0).T, size, 0, range(-lower, upper + 1))
+    _draw_segments(ink.T, (walls & Wall.E != 0).T, size, size, range(-lower, upper + 1))
+
+    # Masked cells are filled including their border
+    if maze.mask is not None:
+        blocked = np.zeros((height, width), dtype=bool)
+        blocked[:-1, :-1] = np.kron(~np.asarray(maze.mask, dtype=bool), np.ones((size, size), dtype=bool))
+        blocked[size::size, :] |= blocked[size - 1:-1:size, :]
+        blocked[:, size::size] |= blocked[:, size - 1:-1:size]
+        ink |= blocked
+
+    indices = np.zeros((height, width), dtype=np.uint8)
+    if color_start_cell and maze.start_cell is not None:
+        x, y = maze.start_cell
+        if 0 <= x < maze.width and 0 <= y < maze.height:
+            indices[y * size + 1:(y + 1) * size, x * size + 1:(x + 1) * size] = START
+    if path is not None and len(path):
+        _draw_path(indices, path, maze.width, size, line_width_pixels)
+    indices[ink] = WALL
+    return indices
+
+
 class MazeVisualizerPIL:
-    def __init__(self, maze, cell_size_pixels, line_width_pixels):
+    # Image modes the maze can be plotted in
+    MODES = ("RGB", "P", "1")
+
+    def __init__(self, maze, cell_size_pixels, line_width_pixels, mode="RGB"):
         """
         Initialize a MazeVisualizerPIL instance.
 
         :param maze: The Maze instance to be visualized
         :param cell_size_pixels: The size of each cell in pixels for the visualized maze
         :param line_width_pixels: The width of the walls in pixels for the visualized maze
+        :param mode: PIL image mode of the plot. "RGB" (default) or "P", a palette image with the same colors
+        and one byte per pixel. "1" uses one bit per pixel, does not color the start cell and draws solutions black.
         """
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported image mode {mode}, expected one of {', '.join(self.MODES)}.")
         self.maze = maze
         self.cell_size_pixels = cell_size_pixels
         self.bg_color = ImageColor.getrgb("white")
         self.fill_color = ImageColor.getrgb("black")
         self.start_color = ImageColor.getrgb("green")
+        self.solution_color = ImageColor.getrgb("red")
         self.line_width = line_width_pixels
+        self.mode = mode
         self._init_plot()
 
     def _init_plot(self):
@@ -193,34 +399,44 @@ class MazeVisualizerPIL:
         """
         width = self.maze.width * self.cell_size_pixels + 1
         height = self.maze.height * self.cell_size_pixels + 1
-        self.img = Image.new(mode="RGB", size=(width, height), color=self.bg_color)
+        if self.mode == "RGB":
+            self.img = Image.new(mode="RGB", size=(width, height), color=self.bg_color)
+        else:
+            self.img = self._image_from_indices(np.full((height, width), BACKGROUND, dtype=np.uint8))
         self.draw = ImageDraw.Draw(self.img)
 
-    def plot_walls(self, color_start_cell=True):
+    @property
+    def palette(self) -> np.ndarray:
         """
-        Plot the walls of the maze cells on the initialized plot.
+        RGB colors of the palette indices BACKGROUND, WALL, START and SOLUTION as uint8 array with shape (4, 3).
         """
-        # Color start cell
-        if color_start_cell:
-            x, y = self.maze.start_cell
-            top_left_pixel, _, _, bottom_right_pixel = self._calc_cell_bbox(x, y)
-            self.draw.rectangle((top_left_pixel, bottom_right_pixel), fill=self.start_color, outline=self.bg_color)
-
-        for hor_index, ver_index in itertools.product(range(self.maze.width), range(self.maze.height)):
-            top_left_pixel, top_right_pixel, bottom_left_pixel, bottom_right_pixel = self._calc_cell_bbox(hor_index,
-                                                                                                          ver_index)
-            if not self.maze.get_mask(CellIndex(x=hor_index, y=ver_index)):
-                self.draw.rectangle((top_left_pixel, bottom_right_pixel), outline=self.fill_color, fill=self.fill_color)
-            cell = self.maze.get_cell(CellIndex(x=hor_index, y=ver_index))
-            if cell.visited is True:
-                if cell.walls[Direction.N]:
-                    self.draw.line((top_left_pixel, top_right_pixel), self.fill_color, self.line_width)
-                if cell.walls[Direction.E]:
-                    self.draw.line((top_right_pixel, bottom_right_pixel), self.fill_color, self.line_width)
-                if cell.walls[Direction.S]:
-                    self.draw.line((bottom_right_pixel, bottom_left_pixel), self.fill_color, self.line_width)
-                if cell.walls[Direction.W]:
-                    self.draw.line((top_left_pixel, bottom_left_pixel), self.fill_color, self.line_width)
+        return np.array([self.bg_color, self.fill_color, self.start_color, self.solution_color], dtype=np.uint8)
+
+    @timed("plot")
+    def plot_walls(self, color_start_cell=True, path: np.ndarray = None):
+        """
+        Plot the walls of the maze cells. The whole image is rendered as an array and replaces the initialized plot.
+
+        :param color_start_cell: If True, color the start cell
+        :param path: Flat cell ids of a path to overlay, e.g. the solution from solver.shortest_path
+        """
+        indices = render_maze_array(self.maze, self.cell_size_pixels, self.line_width,
+                                    color_start_cell and self.mode != "1", path)
+        self.img = self._image_from_indices(indices)
+        self.draw = ImageDraw.Draw(self.img)
+
+    def _image_from_indices(self, indices: np.ndarray) -> Image.Image:
+        """
+        Create an image in the mode of the visualizer from an array of palette indices.
+        """
+        if self.mode == "P":
+            img = Image.fromarray(indices, mode="P")
+            img.putpalette(self.palette.ravel().tolist())
+            return img
+        if self.mode == "1":
+            # White background, black walls and solution, the start cell is not colored
+            return Image.fromarray((indices != WALL) & (indices != SOLUTION), mode="1")
+        return Image.fromarray(self.palette[indices], mode="RGB")
 
     def _calc_cell_bbox(self, hor_index: int, ver_index: int):
         top_left_pixel = (hor_index * self.cell_size_pixels, ver_index * self.cell_size_pixels)
@@ -238,20 +454,526 @@ class MazeVisualizerPIL:
         self.img.save(filename)
 
 
-def generate_maze(width: int, height: int, start_cell_index: CellIndex = None, mask: np.ndarray = None) -> Maze:
+def _runs(segments: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Generate a maze with the given width, height, start_cell_index, and mask.
-    :param width: The width of the maze in cells
-    :param height: The height of the maze in cells
-    :param start_cell_index: The index of the start cell (default is (0, 0))
-    :param mask: An optional mask to apply to the maze
-    :return: The generated maze
+    Find the runs of consecutive True values in every row of a bool array.
+
+    :param segments: Bool array of shape (lines, cells)
+    :return: Line index, first cell and end cell (exclusive) of every run, ordered by line and first cell
+    """
+    padded = np.zeros((segments.shape[0], segments.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = segments
+    steps = np.diff(padded, axis=1)
+    lines, starts = np.nonzero(steps == 1)
+    _, ends = np.nonzero(steps == -1)
+    return lines, starts, ends
+
+
+class MazeVisualizerSVG:
+    def __init__(self, maze, cell_size_pixels, line_width_pixels, chunk_size=4096):
+        """
+        Initialize a MazeVisualizerSVG instance. Collinear walls are merged into a single line, so the size of the
+        document grows with the number of wall runs instead of the number of pixels.
+
+        :param maze: The Maze instance to be visualized
+        :param cell_size_pixels: The size of each cell in SVG user units for the visualized maze
+        :param line_width_pixels: The width of the walls in SVG user units for the visualized maze
+        :param chunk_size: Number of wall runs written per chunk of the document
+        """
+        self.maze = maze
+        self.cell_size_pixels = cell_size_pixels
+        self.line_width = line_width_pixels
+        self.bg_color = "#{:02x}{:02x}{:02x}".format(*ImageColor.getrgb("white"))
+        self.fill_color = "#{:02x}{:02x}{:02x}".format(*ImageColor.getrgb("black"))
+        self.start_color = "#{:02x}{:02x}{:02x}".format(*ImageColor.getrgb("green"))
+        self.solution_color = "#{:02x}{:02x}{:02x}".format(*ImageColor.getrgb("red"))
+        self.chunk_size = chunk_size
+
+    def _wall_runs(self) -> Iterator[str]:
+        """
+        Yield path data for all walls, every wall run is a single move and line command.
+        """
+        size = self.cell_size_pixels
+        walls = np.where(self.maze.visited, self.maze.walls, 0)
+        horizontal = np.zeros((self.maze.height + 1, self.maze.width), dtype=bool)
+        horizontal[:-1] |= walls & Wall.N != 0
+        horizontal[1:] |= walls & Wall.S != 0
+        vertical = np.zeros((self.maze.width + 1, self.maze.height), dtype=bool)
+        vertical[:-1] |= (walls & Wall.W != 0).T
+        vertical[1:] |= (walls & Wall.E != 0).T
+        for segments, command in ((horizontal, "M{1} {0}H{2}"), (vertical, "M{0} {1}V{2}")):
+            lines, starts, ends = _runs(segments)
+            runs = np.stack((lines, starts, ends), axis=1) * size
+            for first in range(0, len(runs), self.chunk_size):
+                yield "".join(command.format(*run) for run in runs[first:first + self.chunk_size].tolist())
+
+    def _masked_runs(self) -> Iterator[str]:
+        """
+        Yield path data filling the masked cells, merged into one rectangle per run of masked cells in a row.
+        """
+        size = self.cell_size_pixels
+        rows, starts, ends = _runs(~np.asarray(self.maze.mask, dtype=bool))
+        runs = np.stack((starts * size, rows * size, (ends - starts) * size + 1), axis=1)
+        for first in range(0, len(runs), self.chunk_size):
+            yield "".join(f"M{x} {y}h{w}v{size + 1}h{-w}z" for x, y, w in runs[first:first + self.chunk_size].tolist())
+
+    def _path_points(self, path: np.ndarray) -> Iterator[str]:
+        """
+        Yield path data for a line through the cell centers of a path, with a point only where the path turns.
+        """
+        size = self.cell_size_pixels
+        y, x = np.divmod(np.asarray(path, dtype=np.int64), self.maze.width)
+        step = np.diff(y * self.maze.width + x)
+        turns = np.flatnonzero(step[1:] != step[:-1]) + 1
+        corners = np.concatenate(([0], turns, [len(path) - 1]))
+        points = np.stack((x[corners], y[corners]), axis=1) * size + size // 2
+        for first in range(0, len(points), self.chunk_size):
+            yield "".join(f"L{px} {py}" for px, py in points[first:first + self.chunk_size].tolist())
+
+    def iter_svg(self, color_start_cell=True, path: np.ndarray = None) -> Iterator[str]:
+        """
+        Produce the SVG document of the maze piece by piece, so it can be streamed while it is being generated.
+
+        :param color_start_cell: If True, color the start cell
+        :param path: Flat cell ids of a path to overlay, e.g. the solution from solver.shortest_path
+        :return: Iterator over the chunks of the document
+        """
+        size = self.cell_size_pixels
+        width = self.maze.width * size + 1
+        height = self.maze.height * size + 1
+        yield (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+               f'viewBox="0 0 {width} {height}" shape-rendering="crispEdges">'
+               f'<rect width="{width}" height="{height}" fill="{self.bg_color}"/>')
+        if color_start_cell and self.maze.start_cell is not None:
+            x, y = self.maze.start_cell
+            yield (f'<rect x="{x * size + 1}" y="{y * size + 1}" width="{size - 1}" height="{size - 1}" '
+                   f'fill="{self.start_color}"/>')
+        if self.maze.mask is not None:
+            yield f'<path fill="{self.fill_color}" d="'
+            yield from self._masked_runs()
+            yield '"/>'
+        # Lines are centered on the pixels of the raster plot
+        yield (f'<path transform="translate(0.5 0.5)" fill="none" stroke="{self.fill_color}" '
+               f'stroke-width="{self.line_width}" stroke-linecap="square" d="')
+        yield from self._wall_runs()
+        yield '"/>'
+        if path is not None and len(path):
+            # The first point is drawn as line from itself, so a path of a single cell is visible as well
+            y, x = divmod(int(path[0]), self.maze.width)
+            yield (f'<path transform="translate(0.5 0.5)" fill="none" stroke="{self.solution_color}" '
+                   f'stroke-width="{self.line_width}" stroke-linecap="square" stroke-linejoin="miter" '
+                   f'd="M{x * size + size // 2} {y * size + size // 2}')
+            yield from self._path_points(path)
+            yield '"/>'
+        yield '</svg>\n'
+
+    def save_plot(self, filename: str, color_start_cell=True, path: np.ndarray = None):
+        """
+        Write the SVG document to a file with the given filename.
+
+        :param filename: The name of the file to save the plot
+        :param color_start_cell: If True, color the start cell
+        :param path: Flat cell ids of a path to overlay
+        """
+        with open(filename, "w") as file:
+            for chunk in self.iter_svg(color_start_cell, path):
+                file.write(chunk)
+
+
+# Flat cell id offset of the neighbour in each Direction is (-width, 1, width, -1).
+_OPPOSITE_WALL = (Wall.S, Wall.W, Wall.N, Wall.E)
+# Directions whose bit is set, for every possible wall bitmask.
+_DIRECTIONS_FOR_BITS = tuple(tuple(d for d in Direction if bits & (1 << d)) for bits in range(16))
+# Random numbers used by the backtracker are drawn from [0, 12), since 12 is divisible by every possible number of
+# candidate directions. _CHOSEN_DIRECTION[bits * 12 + random] is the direction chosen for a candidate bitmask.
+_RANDOM_RANGE = 12
+_CHOSEN_DIRECTION = tuple(directions[r % len(directions)] if directions else -1
+                          for directions in _DIRECTIONS_FOR_BITS for r in range(_RANDOM_RANGE))
+
+
+def _backtrack(walls: bytearray, visited: bytearray, allowed: bytes, width: int, starts: Iterable[int],
+               rng: np.random.Generator, chunk_size: int = 1 << 16):
+    """
+    Recursive backtracker working on flat cell ids (y * width + x).
+    All arguments are flat buffers which are modified in place.
+
+    :param walls: Wall bitmask per cell
+    :param visited: Visited flag per cell
+    :param allowed: Bitmask of the directions in which a cell has a neighbour the algorithm may move to
+    :param width: Width of the maze in cells, used to calculate the neighbour offsets
+    :param starts: Ids of the start cells. A new maze is started from every start cell that was not visited yet, so
+    they all have to be allowed by the mask.
+    :param rng: Random generator from which random numbers are drawn in bulk
+    :param chunk_size: Number of random numbers to draw at once
+    """
+    offsets = (-width, 1, width, -1)
+    wall_bits = tuple(int(1 << direction) for direction in Direction)
+    opposite_bits = tuple(int(wall) for wall in _OPPOSITE_WALL)
+    clear_opposite = tuple(~bit & 0xFF for bit in opposite_bits)
+    directions_for_bits = _DIRECTIONS_FOR_BITS
+    chosen_direction = _CHOSEN_DIRECTION
+    # Bitmask of directions leading to neighbours which were not visited yet
+    free = bytearray(allowed)
+    stack = [0] * len(walls)
+    stack_size = 0
+    random_range = _RANDOM_RANGE
+    randoms = rng.integers(0, random_range, chunk_size, dtype=np.uint8).tolist()
+    random_index = 0
+
+    for start in starts:
+        if visited[start]:
+            continue
+        current = start
+        visited[current] = 1
+        for direction in directions_for_bits[allowed[current]]:
+            free[current + offsets[direction]] &= clear_opposite[direction]
+        while True:
+            bits = free[current]
+            if bits:
+                if random_index == chunk_size:
+                    randoms = rng.integers(0, random_range, chunk_size, dtype=np.uint8).tolist()
+                    random_index = 0
+                direction = chosen_direction[bits * random_range + randoms[random_index]]
+                random_index += 1
+                chosen = current + offsets[direction]
+                walls[current] ^= wall_bits[direction]
+                walls[chosen] ^= opposite_bits[direction]
+                stack[stack_size] = current
+                stack_size += 1
+                visited[chosen] = 1
+                for direction in directions_for_bits[allowed[chosen]]:
+                    free[chosen + offsets[direction]] &= clear_opposite[direction]
+                current = chosen
+            elif stack_size > 0:
+                stack_size -= 1
+                current = stack[stack_size]
+            else:
+                break
+
+
+ALGORITHMS = {}
+
+
+def register_algorithm(name: str):
+    """
+    Decorator to register a maze generation algorithm under the given name, making it available in generate_maze.
+    An algorithm is called with the empty maze, a bool array of the cells to connect, the start cell index and a numpy
+    random generator. It has to connect all given cells, remove walls only between them and set their visited flag.
+
+    :param name: Name under which the algorithm can be selected
+    """
+    def decorator(func):
+        ALGORITHMS[name] = func
+        return func
+    return decorator
+
+
+def _carve_passages(maze: Maze, east: np.ndarray, south: np.ndarray):
+    """
+    Remove the walls between cells for many cells at once.
+
+    :param maze: Maze in which to remove walls
+    :param east: Bool array of shape (height, width), True removes the wall to the east neighbour of the cell
+    :param south: Bool array of shape (height, width), True removes the wall to the south neighbour of the cell
+    """
+    maze.walls[east] &= ~np.uint8(Wall.E)
+    maze.walls[:, 1:][east[:, :-1]] &= ~np.uint8(Wall.W)
+    maze.walls[south] &= ~np.uint8(Wall.S)
+    maze.walls[1:, :][south[:-1, :]] &= ~np.uint8(Wall.N)
+
+
+def _find_roots(parent: np.ndarray) -> np.ndarray:
+    """
+    Return the root of every node of a forest given by parent pointers, using pointer jumping.
+
+    :param parent: Flat array of parent ids, a root is its own parent
+    :return: Flat array of root ids
+    """
+    root = parent
+    while True:
+        next_root = root[root]
+        if np.array_equal(next_root, root):
+            return root
+        root = next_root
+
+
+def _label_components(maze: Maze, cells: np.ndarray) -> np.ndarray:
+    """
+    Label the connected components of the given cells. The trees of a forest are hooked together along the edges
+    between them, always below the smaller root id, and then flattened by pointer jumping, until no edge connects
+    two trees. Every round at least halves the number of trees.
+
+    :param maze: Maze whose mask limits the neighbours of a cell
+    :param cells: Bool array of shape (height, width) with the cells to label
+    :return: Flat array with the smallest cell id of the component per cell, -1 for other cells
+    """
+    cells = cells.ravel()
+    allowed = maze.allowed_directions().ravel() * cells
+    east = np.flatnonzero(allowed & Wall.E)
+    south = np.flatnonzero(allowed & Wall.S)
+    first = np.concatenate((east, south))
+    second = np.concatenate((east + 1, south + maze.width))
+    label = np.arange(cells.size)
+    while first.size:
+        first_root = label[first]
+        second_root = label[second]
+        between_trees = first_root != second_root
+        first, second = first[between_trees], second[between_trees]
+        if not first.size:
+            break
+        first_root, second_root = first_root[between_trees], second_root[between_trees]
+        np.minimum.at(label, np.maximum(first_root, second_root), np.minimum(first_root, second_root))
+        label = _find_roots(label)
+    return np.where(cells, label, -1)
+
+
+def mask_components(mask: np.ndarray) -> Tuple[np.ndarray, List[CellIndex]]:
+    """
+    Label the connected components of a mask and choose a start cell in every component. The start is the leftmost
+    cell of the component, closest to the middle of its height.
+
+    :param mask: Bool array where True marks the cells that may become part of a maze
+    :return: int array of the shape of the mask with the number of the component of every cell, -1 for cells outside
+    of the mask, and the start cell of every component. Components are numbered from left to right by their start,
+    starts in the same column are ordered by their distance to the middle of the mask.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+    label = _label_components(Maze(width, height, mask), mask)
+    cells = np.flatnonzero(label >= 0)
+    if not cells.size:
+        return np.full(mask.shape, -1, dtype=np.int64), []
+    _, component = np.unique(label[cells], return_inverse=True)
+    y, x = np.divmod(cells, width)
+    count = int(component.max()) + 1
+    top = np.full(count, height)
+    np.minimum.at(top, component, y)
+    bottom = np.zeros(count, dtype=np.int64)
+    np.maximum.at(bottom, component, y)
+    order = np.lexsort((np.abs(2 * y - (top + bottom)[component]), x, component))
+    first = order[np.append(True, component[order][1:] != component[order][:-1])]
+    # Renumber the components by the position of their start
+    by_start = np.lexsort((np.abs(2 * y[first] - height), x[first]))
+    number = np.empty(count, dtype=np.int64)
+    number[by_start] = np.arange(count)
+    result = np.full(mask.size, -1, dtype=np.int64)
+    result[cells] = number[component]
+    starts = [CellIndex(x=int(x[first[i]]), y=int(y[first[i]])) for i in by_start]
+    return result.reshape(mask.shape), starts
+
+
+def unreached_components(maze: Maze) -> List[CellIndex]:
+    """
+    Find the components of the mask of the maze that contain no part of the maze.
+
+    :param maze: A generated maze
+    :return: The start cell of every component without maze, see mask_components
+    """
+    if maze.mask is None:
+        return []
+    label, starts = mask_components(maze.mask)
+    reached = set(np.unique(label[maze.visited & (label >= 0)]).tolist())
+    return [start for number, start in enumerate(starts) if number not in reached]
+
+
+def _join_forest(maze: Maze, cells: np.ndarray, parent: np.ndarray, rng: np.random.Generator):
+    """
+    Join the trees of a spanning forest of the given cells into a single spanning tree per connected component.
+    Passages are opened by Kruskal's algorithm over the edges between different trees, in random order, using an
+    array based union-find over the trees.
+
+    :param maze: Maze in which the passages of the forest are already carved
+    :param cells: Bool array of shape (height, width) with the cells spanned by the forest
+    :param parent: Flat array of parent ids describing the forest, a root is its own parent
+    :param rng: Random generator used to order the edges
+    """
+    width = maze.width
+    cells = cells.ravel()
+    allowed = maze.allowed_directions().ravel()
+    roots = _find_roots(parent)
+    east_edges = np.flatnonzero(cells & (allowed & Wall.E != 0))
+    east_edges = east_edges[roots[east_edges] != roots[east_edges + 1]]
+    south_edges = np.flatnonzero(cells & (allowed & Wall.S != 0))
+    south_edges = south_edges[roots[south_edges] != roots[south_edges + width]]
+    if east_edges.size == 0 and south_edges.size == 0:
+        return
+    # Edges are encoded as 2 * cell id + 1 for south edges
+    edges = rng.permutation(np.concatenate((2 * east_edges, 2 * south_edges + 1)))
+    first = edges >> 1
+    second = first + np.where(edges & 1, width, 1)
+    # Compress the root ids to 0..k-1, so the union-find only needs an entry per tree
+    _, tree = np.unique(roots, return_inverse=True)
+    uf = list(range(int(tree.max()) + 1))
+    carved = []
+    for edge, a, b in zip(edges.tolist(), tree[first].tolist(), tree[second].tolist()):
+        while uf[a] != a:
+            uf[a] = uf[uf[a]]
+            a = uf[a]
+        while uf[b] != b:
+            uf[b] = uf[uf[b]]
+            b = uf[b]
+        if a != b:
+            uf[a] = b
+            carved.append(edge)
+    carved = np.array(carved, dtype=np.int64)
+    east = np.zeros(cells.size, dtype=bool)
+    east[carved[carved & 1 == 0] >> 1] = True
+    south = np.zeros(cells.size, dtype=bool)
+    south[carved[carved & 1 == 1] >> 1] = True
+    _carve_passages(maze, east.reshape(maze.walls.shape), south.reshape(maze.walls.shape))
+
+
+@register_algorithm("backtracker")
+def _generate_backtracker(maze: Maze, cells: np.ndarray, start_cell_index: CellIndex, rng: np.random.Generator):
+    """
+    Recursive backtracker on the flat arrays of the maze. Creates long, winding corridors.
+    """
+    walls = bytearray(maze.walls.tobytes())
+    visited = bytearray(maze.visited.tobytes())
+    allowed = maze.allowed_directions().tobytes()
+    start = start_cell_index.y * maze.width + start_cell_index.x
+    # The passages of a start cell outside of the cells are never marked as used, the backtracker would return
+    # to it forever
+    if 0 <= start_cell_index.x < maze.width and 0 <= start_cell_index.y < maze.height and cells.flat[start]:
+        _backtrack(walls, visited, allowed, maze.width, [start], rng)
+    # The backtracker only reaches the component of its start cell, other components get their own start
+    remaining = cells.ravel() & ~np.frombuffer(visited, dtype=bool)
+    if remaining.any():
+        _backtrack(walls, visited, allowed, maze.width, np.flatnonzero(remaining).tolist(), rng)
+    maze.walls[...] = np.frombuffer(walls, dtype=np.uint8).reshape(maze.walls.shape)
+    maze.visited[...] = np.frombuffer(visited, dtype=bool).reshape(maze.visited.shape)
+
+
+@register_algorithm("binary_tree")
+def _generate_binary_tree(maze: Maze, cells: np.ndarray, start_cell_index: CellIndex, rng: np.random.Generator):
+    """
+    Binary tree algorithm, vectorized over the whole grid. Every cell opens a passage either north or east.
+    Creates a strong diagonal bias and long corridors along the north and east border.
+    """
+    allowed = maze.allowed_directions()
+    can_north = cells & (allowed & Wall.N != 0)
+    can_east = cells & (allowed & Wall.E != 0)
+    coin = rng.random(cells.shape) < 0.5
+    go_north = can_north & (coin | ~can_east)
+    go_east = can_east & ~go_north
+    south = np.zeros_like(go_north)
+    south[:-1, :] = go_north[1:, :]
+    _carve_passages(maze, go_east, south)
+    maze.visited[...] = cells
+
+    ids = np.arange(cells.size).reshape(cells.shape)
+    parent = np.where(go_north, ids - maze.width, np.where(go_east, ids + 1, ids)).ravel()
+    # Cells without a passage north or east become roots, which happens in masked mazes
+    _join_forest(maze, cells, parent, rng)
+
+
+@register_algorithm("sidewinder")
+def _generate_sidewinder(maze: Maze, cells: np.ndarray, start_cell_index: CellIndex, rng: np.random.Generator):
+    """
+    Sidewinder algorithm, vectorized over the whole grid. Every row is split into random runs of cells connected
+    east and every run opens one passage north from a random cell of the run.
+    """
+    allowed = maze.allowed_directions()
+    can_north = (cells & (allowed & Wall.N != 0)).ravel()
+    can_east = cells & (allowed & Wall.E != 0)
+    # Cells that can't go north always continue the run, so the top row becomes a single corridor
+    go_east = can_east & ((rng.random(cells.shape) < 0.5) | ~can_north.reshape(cells.shape))
+    run_starts = np.ones_like(go_east)
+    run_starts[:, 1:] = ~go_east[:, :-1]
+    run_id = np.cumsum(run_starts.ravel()) - 1
+    run_end = np.flatnonzero(np.append(run_starts.ravel()[1:], True))
+
+    # Select the cell with the largest random key per run, only cells that can go north get a valid key
+    key = np.where(can_north, rng.random(cells.size), -1.0)
+    order = np.lexsort((key, run_id))
+    chosen = order[np.append(run_id[order][1:] != run_id[order][:-1], True)]
+    chosen = np.where(can_north[chosen], chosen, run_end)
+    go_north = np.zeros(cells.size, dtype=bool)
+    go_north[chosen] = can_north[chosen]
+
+    south = np.zeros_like(go_east)
+    south[:-1, :] = go_north.reshape(cells.shape)[1:, :]
+    _carve_passages(maze, go_east, south)
+    maze.visited[...] = cells
+
+    # Within a run, cells point towards the chosen cell, which points north
+    ids = np.arange(cells.size)
+    run_chosen = chosen[run_id]
+    parent = np.where(ids < run_chosen, ids + 1, ids - 1)
+    parent[chosen] = np.where(go_north[chosen], chosen - maze.width, chosen)
+    # Runs without a passage north become roots, which happens in masked mazes
+    _join_forest(maze, cells, parent, rng)
+
+
+@register_algorithm("kruskal")
+def _generate_kruskal(maze: Maze, cells: np.ndarray, start_cell_index: CellIndex, rng: np.random.Generator):
+    """
+    Randomized Kruskal algorithm: open passages in random order between cells that are not connected yet, using an
+    array based union-find. Creates many short dead ends.
+    """
+    maze.visited[...] = cells
+    _join_forest(maze, cells, np.arange(maze.walls.size), rng)
+
+
+@register_algorithm("wilson")
+def _generate_wilson(maze: Maze, cells: np.ndarray, start_cell_index: CellIndex, rng: np.random.Generator,
+                     chunk_size: int = 1 << 16):
+    """
+    Wilson's algorithm: add loop-erased random walks to the maze until it contains every cell. Creates an unbiased
+    maze, i.e. every possible maze is equally likely. Slow for large mazes, since the first walks are long.
+    """
+    width = maze.width
+    offsets = (-width, 1, width, -1)
+    wall_bits = tuple(int(1 << direction) for direction in Direction)
+    opposite_bits = tuple(int(wall) for wall in _OPPOSITE_WALL)
+    chosen_direction = _CHOSEN_DIRECTION
+    random_range = _RANDOM_RANGE
+    allowed = (maze.allowed_directions() * cells).tobytes()
+    walls = bytearray(maze.walls.tobytes())
+
+    # Every connected component of the mask starts with one cell in the maze, for the component of the start cell
+    # this is the start cell
+    label = _label_components(maze, cells)
+    in_maze = bytearray(cells.size)
+    for root in np.unique(label[label >= 0]).tolist():
+        in_maze[root] = 1
+    start = start_cell_index.y * width + start_cell_index.x
+    if 0 <= start_cell_index.x < width and 0 <= start_cell_index.y < maze.height and label[start] >= 0:
+        in_maze[label[start]] = 0
+        in_maze[start] = 1
+
+    walk_direction = bytearray(cells.size)
+    randoms = rng.integers(0, random_range, chunk_size, dtype=np.uint8).tolist()
+    random_index = 0
+    for cell in rng.permutation(np.flatnonzero(cells)).tolist():
+        # Random walk until the maze is hit, remembering only the last direction taken from each cell. This erases
+        # the loops of the walk.
+        current = cell
+        while not in_maze[current]:
+            if random_index == chunk_size:
+                randoms = rng.integers(0, random_range, chunk_size, dtype=np.uint8).tolist()
+                random_index = 0
+            direction = chosen_direction[allowed[current] * random_range + randoms[random_index]]
+            random_index += 1
+            walk_direction[current] = direction
+            current += offsets[direction]
+        # Add the loop-erased walk to the maze
+        current = cell
+        while not in_maze[current]:
+            direction = walk_direction[current]
+            in_maze[current] = 1
+            walls[current] ^= wall_bits[direction]
+            current += offsets[direction]
+            walls[current] ^= opposite_bits[direction]
+    maze.walls[...] = np.frombuffer(walls, dtype=np.uint8).reshape(maze.walls.shape)
+    maze.visited[...] = cells
+
+
+def _generate_reference(maze: Maze, start_cell_index: CellIndex, rng: random.Random):
+    """
+    Run the recursive backtracker cell by cell using the Maze methods.
     """
-    maze = Maze(width, height, mask)
     stack = Stack()
-    if start_cell_index is None:
-        start_cell_index = CellIndex(x=0, y=0)
-    maze.start_cell = start_cell_index
     current_cell_index = start_cell_index
     maze.set_visited(current_cell_index)
     while True:
@@ -259,7 +981,7 @@ def generate_maze(width: int, height: int, start_cell_index: CellIndex = None, m
         # if the current cell has any neighbours which have not been visited
         if len(unvisited_cells) > 0:
             # choose one random unvisited neighbour and travel there
-            chosen_cell_index = choice(unvisited_cells)
+            chosen_cell_index = rng.choice(unvisited_cells)
             stack.push(current_cell_index)
             maze.move(current_cell_index, chosen_cell_index)
             current_cell_index = chosen_cell_index
@@ -268,38 +990,162 @@ def generate_maze(width: int, height: int, start_cell_index: CellIndex = None, m
             current_cell_index = stack.pop()
         else:
             break
+
+
+def seed_to_int(seed: Union[int, str]) -> int:
+    """
+    Convert a seed to a non-negative integer. Strings of digits are read as numbers, so a seed given on the command
+    line or in an URL gives the same maze as the integer. Other strings are hashed.
+
+    :param seed: Integer or string seed
+    :return: Integer seed
+    """
+    if isinstance(seed, str):
+        if seed.isdigit():
+            return int(seed)
+        return int.from_bytes(hashlib.sha256(seed.encode()).digest()[:8], "little")
+    return int(seed)
+
+
+def make_rng(seed: Union[int, str, None] = None) -> np.random.Generator:
+    """
+    Create an isolated random generator, so results do not depend on or change the global random state.
+
+    :param seed: Integer or string seed, None for a random seed
+    :return: numpy random generator
+    """
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(seed_to_int(seed))
+
+
+def _selected_cells(maze: Maze, start_cell_index: CellIndex, components: Union[str, List[CellIndex]]) -> np.ndarray:
+    """
+    Return the cells of the components of the mask that are selected by the components argument of generate_maze.
+    """
+    cells = maze.cells()
+    if maze.mask is None or components == "all":
+        return cells
+    label = _label_components(maze, cells).reshape(cells.shape)
+    starts = [start_cell_index] + ([] if components == "start" else list(components))
+    selected = [label[start.y, start.x] for start in starts if 0 <= start.x < maze.width and 0 <= start.y < maze.height]
+    return np.isin(label, selected) & cells
+
+
+@timed("generate")
+def generate_maze(width: int, height: int, start_cell_index: CellIndex = None, mask: np.ndarray = None,
+                  engine: str = "fast", algorithm: str = "backtracker", seed: Union[int, str, None] = None,
+                  components: Union[str, List[CellIndex]] = "start") -> Maze:
+    """
+    Generate a maze with the given width, height, start_cell_index, and mask.
+    :param width: The width of the maze in cells
+    :param height: The height of the maze in cells
+    :param start_cell_index: The index of the start cell (default is (0, 0))
+    :param mask: An optional mask to apply to the maze
+    :param engine: "fast" (default) runs the algorithm on arrays. "reference" runs the original cell by cell
+    implementation of the backtracker. Both create the same kind of perfect maze.
+    :param algorithm: Name of the generation algorithm, one of ALGORITHMS (default is "backtracker")
+    :param seed: Integer or string seed making the maze reproducible. None (default) creates a different maze
+    every time.
+    :param components: Which connected components of the mask become a maze. "start" (default) only fills the
+    component of the start cell, "all" every component. A list of cells fills the components containing them in
+    addition to the one of the start cell. Every component becomes a maze of its own.
+    :return: The generated maze
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm {algorithm}, expected one of {', '.join(ALGORITHMS)}.")
+    maze = Maze(width, height, mask)
+    if start_cell_index is None:
+        start_cell_index = CellIndex(x=0, y=0)
+    maze.start_cell = start_cell_index
+    maze.seed = seed
+    if engine == "fast":
+        cells = _selected_cells(maze, start_cell_index, components)
+        ALGORITHMS[algorithm](maze, cells, start_cell_index, make_rng(seed))
+    elif engine == "reference":
+        if algorithm != "backtracker":
+            raise ValueError("The reference engine only implements the backtracker algorithm.")
+        if components != "start":
+            raise ValueError("The reference engine only fills the component of the start cell.")
+        _generate_reference(maze, start_cell_index, random.Random(None if seed is None else seed_to_int(seed)))
+    else:
+        raise ValueError(f"Unknown engine {engine}, expected 'fast' or 'reference'.")
     return maze
 
 
-def plot_maze(maze: Maze, output_filename: str, cell_size_pixels: int = 5, line_width_pixels: int = 1):
+def plot_maze(maze: Maze, output_filename: str, cell_size_pixels: int = 5, line_width_pixels: int = 1,
+              mode: str = "RGB", path: np.ndarray = None):
     """
-    Plot the maze and save the plot to a file.
+    Plot the maze and save the plot to a file. Filenames ending in .svg are saved as SVG, others as raster image.
     :param maze: The maze to plot
     :param output_filename: The name of the file to save the plot
     :param cell_size_pixels: The size of each cell in pixels for plotting (default is 5)
     :param line_width_pixels: The width of the cell walls in pixels for plotting (default is 1)
+    :param mode: Image mode of the plot, see MazeVisualizerPIL (default is "RGB")
+    :param path: Flat cell ids of a path to overlay, e.g. the solution from solver.shortest_path
     """
-    visualizer = MazeVisualizerPIL(maze, cell_size_pixels, line_width_pixels)
-    visualizer.plot_walls()
+    if output_filename.lower().endswith(".svg"):
+        MazeVisualizerSVG(maze, cell_size_pixels, line_width_pixels).save_plot(output_filename, path=path)
+        return
+    visualizer = MazeVisualizerPIL(maze, cell_size_pixels, line_width_pixels, mode)
+    visualizer.plot_walls(path=path)
     visualizer.save_plot(output_filename)
 
 
-def masked_maze(text: str, fontsize: int, bordersize: int):
-    mask_img = text_mask(text, fontsize, bordersize, invert=False)
-    start = find_start(mask_img)
-    mask = text_mask_to_boolarray(mask_img)
-    maze = generate_maze(mask.shape[1], mask.shape[0], CellIndex(*start), mask=mask)
-    return maze
+def letter_mask(text: str, fontsize: int, bordersize: int) -> Tuple[np.ndarray, List[CellIndex]]:
+    """
+    Create the mask of a text and find the start cells of its letters.
+
+    :param text: Text used as mask
+    :param fontsize: Font size of the text in cells
+    :param bordersize: Size of the empty border around the text in cells
+    :return: Bool mask that is True inside the letters and the start cells of the parts of the text that are not
+    connected to each other, from left to right
+    """
+    mask = text_mask_to_boolarray(text_mask(text, fontsize, bordersize, invert=False))
+    label, starts = mask_components(mask)
+    # The area around the text is a component as well, it is the one touching the border of the image
+    outside = set(np.unique(np.concatenate((label[0], label[-1], label[:, 0], label[:, -1]))).tolist())
+    letters = [start for number, start in enumerate(starts) if number not in outside]
+    if not letters:
+        raise ValueError(f"The text {text!r} has no letters to fill with a maze.")
+    return mask, letters
+
+
+def masked_maze(text: str, fontsize: int, bordersize: int, algorithm: str = "backtracker",
+                seed: Union[int, str, None] = None, all_components: bool = False):
+    """
+    Generate a maze inside the letters of a text.
+
+    :param text: Text used as mask
+    :param fontsize: Font size of the text in cells
+    :param bordersize: Size of the empty border around the text in cells
+    :param algorithm: Name of the generation algorithm, one of ALGORITHMS
+    :param seed: Integer or string seed making the maze reproducible
+    :param all_components: If False (default), only the leftmost letter that is not connected to the others and
+    the letters connected to it are filled. If True, all letters are filled.
+    :return: The generated maze
+    """
+    mask, letters = letter_mask(text, fontsize, bordersize)
+    return generate_maze(mask.shape[1], mask.shape[0], letters[0], mask=mask, algorithm=algorithm, seed=seed,
+                         components=letters if all_components else "start")
 
 
 if __name__ == '__main__':
     # top level parser
     parser = argparse.ArgumentParser(description="Generate mazes.")
-    parser.add_argument("-f", "--filename", help="Filename that is used to save the maze.", default="maze.png")
+    parser.add_argument("-f", "--filename", help="Filename that is used to save the maze. Filenames ending in .svg are saved as SVG.", default="maze.png")
     parser.add_argument("-s", "--seed", default=None, help="Seed for random generator.")
     parser.add_argument("-o", "--origin", nargs=2, type=int, default=[0, 0], help="x y coordinate of the start cell in the maze")
     parser.add_argument("-c", "--cellsize", type=int, default=5, help="Cell size in pixels for plotting.")
     parser.add_argument("-l", "--linewidth", type=int, default=1, help="Line width of cell walls for plotting in pixels.")
+    parser.add_argument("-a", "--algorithm", choices=ALGORITHMS, default="backtracker", help="Algorithm used to generate the maze.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Generate the maze in tiles on this many processes, 0 uses all cores. Only used by the generate and save commands and mask images. The batch command and --best-of run this many mazes at once, by default on all cores.")
+    parser.add_argument("--tilesize", type=int, default=1024, help="Edge length of the tiles in cells if --jobs is given.")
+    parser.add_argument("--solve", action="store_true", help="Draw the solution into the plot, the path from the start cell to the cell farthest away from it.")
+    parser.add_argument("--longest", action="store_true", help="With --solve, draw the longest path in the maze instead.")
+    parser.add_argument("--best-of", type=int, default=1, help="Generate this many candidate mazes on --jobs processes and keep the best one by --score. Used by the generate, save and mask commands.")
+    parser.add_argument("--score", choices=("publishing", "dead_ends", "solution", "twisty"), default="publishing", help="How --best-of rates the candidates: publishing prefers many dead ends, a long solution and few straight corridors, the others only one of these.")
     # sub parsers
     subparsers = parser.add_subparsers(dest="command", help="Select between just maze generation with width/height or generating a maze with a mask.")
 
@@ -307,21 +1153,132 @@ if __name__ == '__main__':
     parser_generate.add_argument("width", type=int, help="Width of the maze in cells.")
     parser_generate.add_argument("height", type=int, help="Height of the maze in cells.")
 
-    parser_mask = subparsers.add_parser("mask", help="Apply mask to limit maze.")
+    parser_stream = subparsers.add_parser("stream", help="Generate a rectangular maze row by row with Eller's algorithm and write it as PNG while it is generated. Memory use only depends on the width, so the height is only limited by disk space.")
+    parser_stream.add_argument("width", type=int, help="Width of the maze in cells.")
+    parser_stream.add_argument("height", type=int, help="Height of the maze in cells.")
+
+    parser_save = subparsers.add_parser("save", help="Generate a maze within a rectangle and save it in the binary .maze format, which can be plotted with the render command.")
+    parser_save.add_argument("width", type=int, help="Width of the maze in cells.")
+    parser_save.add_argument("height", type=int, help="Height of the maze in cells.")
+
+    parser_render = subparsers.add_parser("render", help="Plot a maze saved in the .maze format. PNG images are rendered in bands, so the maze does not have to fit into memory.")
+    parser_render.add_argument("input", help="The .maze file to plot.")
+
+    parser_mask = subparsers.add_parser("mask", help="Apply mask to limit maze. Filenames ending in .maze save the maze instead of plotting it.")
     parser.add_argument("-d", "--fontsize", type=int, default=32, help="Font size for text mask. Only used if text is specified.")
     parser.add_argument("-b", "--bordersize", type=int, default=32, help="Border size for text mask. Only used if text is specified.")
     group = parser_mask.add_mutually_exclusive_group()
-    group.add_argument("-m", "--maskimg", default=None, help="Image to use as mask, where only white pixels can be visited by the algorithm, while black pixels are forbidden. If this is specified, the maze will be of the same dimensions as the mask image.")
+    group.add_argument("-m", "--maskimg", default=None, help="Image to use as mask, where only white pixels can be visited by the algorithm, while black pixels are forbidden. If this is specified, the maze will be of the same dimensions as the mask image, unless --width or --height are given.")
     group.add_argument("-t", "--text", default=None, help="Text to use as a mask where the maze is generate inside the text. If this is specified, the size of the maze is derived from the text and the fontsize and bordersize parameters.")
-    args = parser.parse_args()
+    parser_mask.add_argument("--width", type=int, default=None, help="Width of the maze in cells for mask images. The mask image is scaled to it, by default one pixel becomes one cell.")
+    parser_mask.add_argument("--height", type=int, default=None, help="Height of the maze in cells for mask images. If only one of width and height is given, the other one keeps the aspect ratio of the mask image.")
+    parser_mask.add_argument("--threshold", type=int, default=128, help="Brightness from 0 to 255 from which on cells of a mask image are part of the maze.")
+    parser_mask.add_argument("--all-components", action="store_true", help="Fill every part of the mask, instead of only the part connected to the start cell.")
 
-    if seed is not None:
-        seed(args.seed)
+    parser_batch = subparsers.add_parser("batch", help="Generate many mazes with different seeds on all cores and write them into the directory or the .zip, .tar, .tar.gz or .tgz archive given by --filename, together with a manifest.csv of seeds, statistics and timings. With --solve, an image of the solution is written next to every maze.")
+    seeds_group = parser_batch.add_mutually_exclusive_group()
+    seeds_group.add_argument("-n", "--count", type=int, default=10, help="Number of mazes. Their seeds are drawn from --seed, so the same seed gives the same batch.")
+    seeds_group.add_argument("--seeds", nargs=2, type=int, metavar=("FIRST", "LAST"), default=None, help="Generate one maze per seed from FIRST to LAST (inclusive) instead.")
+    parser_batch.add_argument("--width", type=int, default=None, help="Width of the mazes in cells, by default 20 or the width of the mask image.")
+    parser_batch.add_argument("--height", type=int, default=None, help="Height of the mazes in cells, by default 20 or the height of the mask image.")
+    batch_mask_group = parser_batch.add_mutually_exclusive_group()
+    batch_mask_group.add_argument("-m", "--maskimg", default=None, help="Image to use as mask for all mazes.")
+    batch_mask_group.add_argument("-t", "--text", default=None, help="Text to use as mask for all mazes.")
+    parser_batch.add_argument("--threshold", type=int, default=128, help="Brightness from 0 to 255 from which on cells of a mask image are part of the maze.")
+    parser_batch.add_argument("--all-components", action="store_true", help="Fill every part of the mask, instead of only the part connected to the start cell.")
+    parser_batch.add_argument("--format", choices=("png", "webp", "svg"), default="png", help="Image format of the mazes.")
+    args = parser.parse_args()
 
     if args.command is None:
         parser.print_help()
         sys.exit()
 
+    def solve(maze):
+        if not args.solve:
+            return None
+        from solver import shortest_path, longest_path
+        return longest_path(maze) if args.longest else shortest_path(maze)
+
+    def best_seed(build):
+        """
+        Return the seed of the best of --best-of candidate mazes, or --seed if only one is generated.
+
+        :param build: Function generating a maze from the keyword argument seed
+        """
+        if args.best_of <= 1:
+            return args.seed
+        from concurrent.futures import ProcessPoolExecutor
+        from metrics import best_seed, candidate_seeds
+        # The candidates need a seed to generate the best one again
+        seed = args.seed if args.seed is not None else int(make_rng().integers(0, 2 ** 63))
+        with ProcessPoolExecutor(max_workers=args.jobs or None) as executor:
+            seed, metrics = best_seed(build, candidate_seeds(seed, args.best_of), args.score, executor)
+        print(f"Best of {args.best_of} by {args.score} score: seed {seed} with {metrics['dead_ends']} dead ends, "
+              f"solution length {metrics['solution_length']} and {metrics['straight_cells']} straight cells.",
+              file=sys.stderr)
+        return seed
+
+    def output(maze):
+        if args.filename.lower().endswith(".maze"):
+            from mazefile import save_maze
+            save_maze(maze, args.filename)
+        else:
+            plot_maze(maze, args.filename, cell_size_pixels=args.cellsize, line_width_pixels=args.linewidth,
+                      path=solve(maze))
+
+    if args.command.lower() == "render":
+        from mazefile import MazeFile, render_bands
+        maze_file = MazeFile(args.input)
+        if args.solve or not args.filename.lower().endswith(".png"):
+            # Solutions and other formats need the whole maze in memory
+            output(maze_file.to_maze())
+        else:
+            with open(args.filename, "wb") as file:
+                render_bands(maze_file, file, cell_size_pixels=args.cellsize, line_width_pixels=args.linewidth)
+        sys.exit()
+
+    if args.command.lower() == "batch":
+        from batch import BatchOptions, generate_batch
+        mask, start, components = None, CellIndex(x=args.origin[0], y=args.origin[1]), "start"
+        if args.text is not None:
+            mask, letters = letter_mask(args.text, args.fontsize, args.bordersize)
+            start, components = letters[0], letters if args.all_components else "start"
+        elif args.maskimg is not None:
+            try:
+                img = Image.open(args.maskimg)
+            except IOError:
+                sys.exit(f"Can't open maskimage {args.maskimg}.")
+            mask = image_to_mask(img, args.width, args.height, args.threshold)
+            components = "all" if args.all_components else "start"
+            if not (0 <= start.x < mask.shape[1] and 0 <= start.y < mask.shape[0] and mask[start.y, start.x]):
+                _, starts = mask_components(mask)
+                if not starts:
+                    sys.exit("The mask image contains no cells for the maze.")
+                start = starts[0]
+        height, width = mask.shape if mask is not None else (args.height or 20, args.width or 20)
+        if args.seeds is not None:
+            seeds = range(args.seeds[0], args.seeds[1] + 1)
+        else:
+            seeds = make_rng(args.seed).integers(0, 2 ** 63, args.count).tolist()
+        options = BatchOptions(width, height, start, mask, components, args.algorithm, args.cellsize, args.linewidth,
+                               args.format, ("longest" if args.longest else "shortest") if args.solve else None)
+        output_name = "mazes" if args.filename == parser.get_default("filename") else args.filename
+        start_time = time.perf_counter()
+        manifest = generate_batch(seeds, options, output_name, workers=args.jobs or None)
+        print(f"Wrote {len(manifest)} mazes to {output_name} in {time.perf_counter() - start_time:.2f} s.",
+              file=sys.stderr)
+        sys.exit()
+
+    if args.command.lower() == "stream":
+        if args.filename.lower().endswith(".svg"):
+            sys.exit("The stream command only writes PNG images.")
+        from streaming import stream_maze
+        with open(args.filename, "wb") as file:
+            stream_maze(file, args.width, args.height, make_rng(args.seed),
+                        cell_size_pixels=args.cellsize, line_width_pixels=args.linewidth,
+                        start_cell_index=CellIndex(x=args.origin[0], y=args.origin[1]))
+        sys.exit()
+
     # extract mask maze options
     mask = None
     if args.command.lower() == "mask":
@@ -330,15 +1287,42 @@ if __name__ == '__main__':
                 img = Image.open(args.maskimg)
             except IOError:
                 sys.exit(f"Can't open maskimage {args.maskimg}.")
-            mask = np.asarray(img, dtype=bool)
-            args.width = img.size[0]
-            args.height = img.size[1]
+            mask = image_to_mask(img, args.width, args.height, args.threshold)
+            args.height, args.width = mask.shape
         elif args.text is not None:
-            maze = masked_maze(args.text, args.fontsize, args.bordersize)
-            plot_maze(maze, args.filename, cell_size_pixels=args.cellsize, line_width_pixels=args.linewidth)
+            build = functools.partial(masked_maze, args.text, args.fontsize, args.bordersize, args.algorithm,
+                                      all_components=args.all_components)
+            maze = build(seed=best_seed(build))
+            output(maze)
             sys.exit()
         else:
             sys.exit("No mask image or text specified.")
 
-    maze = generate_maze(args.width, args.height, CellIndex(x=args.origin[0], y=args.origin[1]), mask)
-    plot_maze(maze, args.filename, cell_size_pixels=args.cellsize, line_width_pixels=args.linewidth)
+    start = CellIndex(x=args.origin[0], y=args.origin[1])
+    components = "all" if getattr(args, "all_components", False) else "start"
+    if mask is not None and not (0 <= start.x < args.width and 0 <= start.y < args.height and mask[start.y, start.x]):
+        # Choose a start cell in the mask instead of generating nothing
+        _, starts = mask_components(mask)
+        if not starts:
+            sys.exit("The mask image contains no cells for the maze.")
+        start = starts[0]
+    build = functools.partial(generate_maze, args.width, args.height, start, mask, algorithm=args.algorithm,
+                              components=components)
+    if args.best_of > 1:
+        # Tiled generation creates a different maze from the same seed, so the best candidate is not tiled
+        maze = build(seed=best_seed(build))
+    elif args.jobs is not None:
+        from tiled import generate_maze_tiled
+        maze = generate_maze_tiled(args.width, args.height, start, mask, algorithm=args.algorithm, seed=args.seed,
+                                   tile_size=args.tilesize, workers=args.jobs or None, components=components)
+    else:
+        maze = build(seed=args.seed)
+    unreached = unreached_components(maze)
+    if unreached:
+        print(f"{len(unreached)} parts of the mask are not connected to the start cell and were left empty, "
+              f"e.g. the part containing cell {tuple(unreached[0])}. Use --all-components to fill them.", file=sys.stderr)
+    if args.command.lower() == "save":
+        from mazefile import save_maze
+        save_maze(maze, "maze.maze" if args.filename == parser.get_default("filename") else args.filename)
+    else:
+        output(maze)
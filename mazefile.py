@@ -0,0 +1,197 @@
+import struct
+from typing import BinaryIO, Tuple, Union
+
+import numpy as np
+
+from maze import Maze, CellIndex, Wall, render_maze_array, MazeVisualizerPIL
+from streaming import PNGWriter
+
+# A .maze file starts with a fixed header, followed by the seed as UTF-8 and the cell data at data_offset.
+# Cell data is one row after another, every row padded to whole bytes, with 4 bits per cell. The cell with the even
+# x coordinate is stored in the low nibble. North and west walls are the south and east walls of the neighbours.
+MAGIC = b"MAZE"
+VERSION = 1
+_HEADER = struct.Struct("<4sBBxxIIiiQH")
+# Cells are aligned to this many bytes in the file
+_DATA_ALIGNMENT = 64
+# Header flags
+_HAS_MASK = 1
+_HAS_START = 2
+_HAS_SEED = 4
+# Bits of a cell
+_EAST = 1
+_SOUTH = 2
+_VISITED = 4
+_ALLOWED = 8
+
+
+def _encode_rows(maze: Maze, y0: int, y1: int) -> np.ndarray:
+    walls = maze.walls[y0:y1]
+    cells = ((walls & Wall.E != 0) * _EAST | (walls & Wall.S != 0) * _SOUTH | maze.visited[y0:y1] * _VISITED).astype(np.uint8)
+    if maze.mask is None:
+        cells |= _ALLOWED
+    else:
+        cells |= np.asarray(maze.mask[y0:y1], dtype=bool) * np.uint8(_ALLOWED)
+    if maze.width % 2:
+        cells = np.pad(cells, ((0, 0), (0, 1)))
+    return cells[:, 0::2] | (cells[:, 1::2] << 4)
+
+
+def save_maze(maze: Maze, filename: str, rows_per_chunk: int = 4096):
+    """
+    Save the maze in the binary .maze format, which stores the walls, the mask, the start cell and the seed with
+    4 bits per cell.
+
+    :param maze: The maze to save
+    :param filename: Name of the file
+    :param rows_per_chunk: Number of rows that are packed at once, limits the additional memory used
+    """
+    flags = 0
+    if maze.mask is not None:
+        flags |= _HAS_MASK
+    start = maze.start_cell
+    if start is not None:
+        flags |= _HAS_START
+    else:
+        start = CellIndex(x=0, y=0)
+    seed = b""
+    if maze.seed is not None:
+        flags |= _HAS_SEED
+        seed = str(maze.seed).encode()
+    data_offset = -(-(_HEADER.size + len(seed)) // _DATA_ALIGNMENT) * _DATA_ALIGNMENT
+    with open(filename, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, flags, maze.width, maze.height, start.x, start.y, data_offset,
+                                len(seed)))
+        file.write(seed)
+        file.write(bytes(data_offset - _HEADER.size - len(seed)))
+        for y0 in range(0, maze.height, rows_per_chunk):
+            file.write(_encode_rows(maze, y0, min(y0 + rows_per_chunk, maze.height)).tobytes())
+
+
+class MazeFile:
+    """
+    A .maze file opened with np.memmap. Rows are only read and decoded when they are accessed, so mazes larger than
+    the memory can be rendered in bands.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Open a .maze file.
+
+        :param filename: Name of the file
+        """
+        with open(filename, "rb") as file:
+            header = file.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ValueError(f"{filename} is not a maze file.")
+            magic, version, flags, width, height, x, y, data_offset, seed_length = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a maze file.")
+            if version != VERSION:
+                raise ValueError(f"Unsupported maze file version {version}, expected {VERSION}.")
+            seed = file.read(seed_length).decode()
+        self.width = width
+        self.height = height
+        self.has_mask = bool(flags & _HAS_MASK)
+        self.start_cell = CellIndex(x=x, y=y) if flags & _HAS_START else None
+        self.seed = seed if flags & _HAS_SEED else None
+        # Packed cells with shape (height, ceil(width / 2)), mapped read only without copying
+        self.data = np.memmap(filename, dtype=np.uint8, mode="r", offset=data_offset,
+                              shape=(height, (width + 1) // 2))
+
+    def _unpack(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        first_byte = x0 // 2
+        packed = np.asarray(self.data[y0:y1, first_byte:(x1 + 1) // 2])
+        cells = np.empty((y1 - y0, packed.shape[1] * 2), dtype=np.uint8)
+        cells[:, 0::2] = packed & 0xF
+        cells[:, 1::2] = packed >> 4
+        return cells[:, x0 - 2 * first_byte:x1 - 2 * first_byte]
+
+    def read_rows(self, y0: int, y1: int, x0: int = 0, x1: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Decode the rows y0 to y1 (exclusive), optionally only the columns x0 to x1 (exclusive).
+
+        :return: Wall bitmask, visited flags and mask of the rows, as stored in the arrays of Maze
+        """
+        x1 = self.width if x1 is None else x1
+        first_row, first_column = max(y0 - 1, 0), max(x0 - 1, 0)
+        cells = self._unpack(first_row, y1, first_column, x1)
+        above = cells[:y0 - first_row, x0 - first_column:]
+        left = cells[y0 - first_row:, :x0 - first_column]
+        cells = cells[y0 - first_row:, x0 - first_column:]
+        east = cells & _EAST != 0
+        south = cells & _SOUTH != 0
+        west = np.ones_like(east)
+        if left.shape[1]:
+            west[:, 0] = left[:, 0] & _EAST != 0
+        west[:, 1:] = east[:, :-1]
+        north = np.ones_like(south)
+        if len(above):
+            north[0] = above[0] & _SOUTH != 0
+        north[1:] = south[:-1]
+        walls = (north * Wall.N | east * Wall.E | south * Wall.S | west * Wall.W).astype(np.uint8)
+        return walls, cells & _VISITED != 0, cells & _ALLOWED != 0
+
+    def window(self, y0: int, y1: int, x0: int = 0, x1: int = None) -> Maze:
+        """
+        Return the rows y0 to y1 (exclusive), optionally only the columns x0 to x1 (exclusive), as a maze of their
+        own, the start cell is moved along.
+        """
+        x1 = self.width if x1 is None else x1
+        walls, visited, allowed = self.read_rows(y0, y1, x0, x1)
+        maze = Maze(x1 - x0, y1 - y0, allowed if self.has_mask else None)
+        maze.walls[...] = walls
+        maze.visited[...] = visited
+        if self.start_cell is not None:
+            maze.start_cell = CellIndex(x=self.start_cell.x - x0, y=self.start_cell.y - y0)
+        maze.seed = self.seed
+        return maze
+
+    def to_maze(self) -> Maze:
+        """
+        Load the whole maze into memory.
+        """
+        return self.window(0, self.height)
+
+
+def load_maze(filename: str) -> Maze:
+    """
+    Load a maze saved with save_maze into memory.
+
+    :param filename: Name of the file
+    :return: The maze
+    """
+    return MazeFile(filename).to_maze()
+
+
+def render_bands(maze_file: Union[str, MazeFile], file: BinaryIO, cell_size_pixels: int = 5,
+                 line_width_pixels: int = 1, band_pixels: int = 1 << 24):
+    """
+    Render a .maze file as PNG band by band, so neither the maze nor the image have to fit into memory.
+    Every band is rendered with the neighbouring rows around it, so the result is the same as the plot of the whole
+    maze.
+
+    :param maze_file: Name of a .maze file or an opened MazeFile
+    :param file: Binary file object to write the PNG image to
+    :param cell_size_pixels: The size of each cell in pixels
+    :param line_width_pixels: The width of the cell walls in pixels
+    :param band_pixels: Approximate number of pixels rendered at once
+    """
+    if isinstance(maze_file, str):
+        maze_file = MazeFile(maze_file)
+    size = cell_size_pixels
+    img_width = maze_file.width * size + 1
+    band_rows = max(1, band_pixels // (img_width * size))
+    # Wide walls reach into the neighbouring rows
+    halo = 1 + line_width_pixels // size
+    palette = MazeVisualizerPIL(Maze(1, 1), size, line_width_pixels).palette
+    with PNGWriter(file, img_width, maze_file.height * size + 1, mode="RGB") as writer:
+        for y0 in range(0, maze_file.height, band_rows):
+            y1 = min(y0 + band_rows, maze_file.height)
+            first, last = max(0, y0 - halo), min(maze_file.height, y1 + halo)
+            window = maze_file.window(first, last)
+            indices = render_maze_array(window, size, line_width_pixels)
+            # The last band also contains the bottom border line
+            top = (y0 - first) * size
+            bottom = (y1 - first) * size + (1 if y1 == maze_file.height else 0)
+            writer.write_rows(palette[indices[top:bottom]])
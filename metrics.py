@@ -0,0 +1,118 @@
+import functools
+from typing import Callable, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from maze import Maze, Wall
+from solver import shortest_path
+
+# Number of passages of a cell for every bitmask of open directions
+_DEGREE = np.array([bin(bits).count("1") for bits in range(16)], dtype=np.uint8)
+_STRAIGHT = (int(Wall.N | Wall.S), int(Wall.E | Wall.W))
+
+
+def maze_metrics(maze: Maze, path: np.ndarray = None) -> dict:
+    """
+    Measure the structure of a maze with array operations over the wall bitmasks.
+    Cells are classified by their number of passages: dead ends have one, corridor cells two and junctions three or
+    four. A corridor cell is straight if its passages are opposite of each other, otherwise it is a turn.
+    A corridor is a chain of connected corridor cells. The river factor is the number of cells off the solution
+    per dead end off the solution, it is high for mazes with few but long dead ends.
+
+    :param maze: The maze to measure
+    :param path: Flat cell ids of the solution, by default the shortest path from the start cell to the cell
+    farthest away from it
+    :return: Dictionary of the metrics, counts of cells and the length of the solution in cells
+    """
+    open_dirs = np.where(maze.visited, ~maze.walls & 0xF, 0).astype(np.uint8)
+    degree = _DEGREE[open_dirs]
+    cells = int(np.count_nonzero(maze.visited))
+    dead_end = degree == 1
+    corridor = degree == 2
+    straight = corridor & np.isin(open_dirs, _STRAIGHT)
+    # Every passage between two corridor cells joins two chains, counted from its west and north cell
+    links = int(np.count_nonzero(corridor[:, :-1] & corridor[:, 1:] & (open_dirs[:, :-1] & Wall.E != 0))
+                + np.count_nonzero(corridor[:-1] & corridor[1:] & (open_dirs[:-1] & Wall.S != 0)))
+    corridor_cells = int(np.count_nonzero(corridor))
+    corridors = corridor_cells - links
+
+    if path is None:
+        path = shortest_path(maze) if cells else np.empty(0, dtype=np.int64)
+    off_path = np.ones(maze.width * maze.height, dtype=bool)
+    off_path[path] = False
+    side_dead_ends = int(np.count_nonzero(dead_end.ravel() & off_path))
+    return {
+        "cells": cells,
+        "dead_ends": int(np.count_nonzero(dead_end)),
+        "corridor_cells": corridor_cells,
+        "straight_cells": int(np.count_nonzero(straight)),
+        "turns": corridor_cells - int(np.count_nonzero(straight)),
+        "three_way_junctions": int(np.count_nonzero(degree == 3)),
+        "four_way_junctions": int(np.count_nonzero(degree == 4)),
+        "corridors": corridors,
+        "mean_corridor_length": corridor_cells / corridors if corridors else 0.0,
+        "river_factor": (cells - len(path)) / side_dead_ends if side_dead_ends else 0.0,
+        "solution_length": len(path),
+    }
+
+
+def _fraction(metrics: dict, name: str) -> float:
+    return metrics[name] / metrics["cells"] if metrics["cells"] else 0.0
+
+
+def score_dead_ends(metrics: dict) -> float:
+    return _fraction(metrics, "dead_ends")
+
+
+def score_solution(metrics: dict) -> float:
+    return _fraction(metrics, "solution_length")
+
+
+def score_twisty(metrics: dict) -> float:
+    return -_fraction(metrics, "straight_cells")
+
+
+def score_publishing(metrics: dict) -> float:
+    """
+    Many dead ends, a long solution and few straight corridors, each measured as fraction of the cells.
+    """
+    return score_dead_ends(metrics) + score_solution(metrics) + score_twisty(metrics)
+
+
+# Scoring functions to select the best of several mazes by, higher is better
+SCORES = {"publishing": score_publishing, "dead_ends": score_dead_ends, "solution": score_solution,
+          "twisty": score_twisty}
+
+
+def candidate_seeds(seed: Union[int, str], count: int) -> List[Union[int, str]]:
+    """
+    Derive the seeds of count candidates from a seed. The first candidate uses the seed itself.
+    """
+    return [seed] + [f"{seed}-{number}" for number in range(1, count)]
+
+
+def _evaluate(build: Callable, score: str, seed) -> Tuple[float, Union[int, str], dict]:
+    metrics = maze_metrics(build(seed=seed))
+    return SCORES[score](metrics), seed, metrics
+
+
+def best_seed(build: Callable, seeds: Iterable, score: str = "publishing", executor=None,
+              timeout: float = None) -> Tuple[object, dict]:
+    """
+    Generate a candidate maze for every seed and find the best one by a score.
+
+    :param build: Function generating a maze from the keyword argument seed. It has to be picklable if an executor
+    is given, e.g. a functools.partial of generate_maze.
+    :param seeds: Seeds of the candidates
+    :param score: Name of the scoring function, one of SCORES
+    :param executor: concurrent.futures executor evaluating the candidates in parallel, None to evaluate them one after
+    another in this process
+    :param timeout: Seconds after which to give up waiting for the executor, see Executor.map
+    :return: Seed of the best candidate, the first one if several are equally good, and its metrics
+    """
+    if score not in SCORES:
+        raise ValueError(f"Unknown score {score}, expected one of {', '.join(SCORES)}.")
+    evaluate = functools.partial(_evaluate, build, score)
+    results = executor.map(evaluate, seeds, timeout=timeout) if executor is not None else map(evaluate, seeds)
+    _, seed, metrics = max(results, key=lambda result: result[0])
+    return seed, metrics
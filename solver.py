@@ -0,0 +1,255 @@
+from typing import Tuple
+
+import numpy as np
+
+from maze import Maze, CellIndex, Direction
+
+# Directions are numbered clockwise, so the next direction of a cell in clockwise order is (direction + 1) % 4
+_OPPOSITE = np.array([(direction + 2) % 4 for direction in Direction], dtype=np.int64)
+
+
+def _flat_id(maze: Maze, cell_index: CellIndex) -> int:
+    x, y = cell_index
+    if not (0 <= x < maze.width and 0 <= y < maze.height):
+        raise ValueError(f"Cell {cell_index} is not inside the maze.")
+    return y * maze.width + x
+
+
+def _open_directions(maze: Maze) -> np.ndarray:
+    """
+    Return the bitmask of the directions in which every cell has a passage, 0 for cells that are not in the maze.
+    """
+    return np.where(maze.visited, ~maze.walls & 0xF, 0).astype(np.uint8).ravel()
+
+
+def _frontier_distances(maze: Maze, start: int) -> np.ndarray:
+    """
+    Breadth first search from the start cell, one array operation per distance instead of one step per cell.
+    Works for every maze, but needs as many steps as the longest distance.
+    """
+    open_dirs = _open_directions(maze)
+    offsets = (-maze.width, 1, maze.width, -1)
+    distance = np.full(open_dirs.size, -1, dtype=np.int64)
+    distance[start] = 0
+    frontier = np.array([start])
+    step = 0
+    while frontier.size:
+        step += 1
+        neighbours = np.concatenate([frontier[open_dirs[frontier] & (1 << direction) != 0] + offsets[direction]
+                                     for direction in Direction])
+        neighbours = neighbours[distance[neighbours] < 0]
+        distance[neighbours] = step
+        frontier = np.unique(neighbours)
+    return distance
+
+
+def _rank_list(successor: np.ndarray, first: int, spacing: int = 64) -> np.ndarray:
+    """
+    Count the elements from every element of a linked list to its end. A random sample of elements walks forward
+    in lockstep until it reaches the next sampled element, which needs about spacing * log(n) array operations.
+    The short list of sampled elements is then ranked by pointer jumping.
+
+    :param successor: Index of the next element of every element. The last element n is the end of the list and
+    its own successor.
+    :param first: Index of the first element of the list
+    :param spacing: Average distance of the sampled elements
+    :return: Number of elements from every element to the end, including itself, -1 for elements that are not part
+    of the list starting at first
+    """
+    n = successor.size - 1
+    # Fixed seed, the result does not depend on the sample
+    sampled = np.random.default_rng(0).random(n + 1) < 1 / spacing
+    sampled[first] = True
+    sampled[n] = False
+    samples = np.flatnonzero(sampled)
+    sample_of = np.full(n + 1, -1, dtype=np.int64)
+    sample_of[samples] = samples
+    offset = np.zeros(n + 1, dtype=np.int64)
+    next_sample = np.full(n + 1, n, dtype=np.int64)
+    gap = np.zeros(n + 1, dtype=np.int64)
+    walker = samples
+    current = successor[samples]
+    step = 1
+    while walker.size:
+        stop = sampled[current] | (current == n)
+        next_sample[walker[stop]] = current[stop]
+        gap[walker[stop]] = step
+        walker, current = walker[~stop], current[~stop]
+        sample_of[current] = walker
+        offset[current] = step
+        current = successor[current]
+        step += 1
+
+    # Pointer jumping over the sampled elements, the end of the list gets the last index
+    sample_index = np.full(n + 1, -1, dtype=np.int64)
+    sample_index[samples] = np.arange(samples.size)
+    sample_index[n] = samples.size
+    sample_successor = np.append(sample_index[next_sample[samples]], samples.size)
+    sample_remaining = np.append(gap[samples], 0)
+    for _ in range(max(1, samples.size.bit_length())):
+        sample_remaining = sample_remaining + sample_remaining[sample_successor]
+        sample_successor = sample_successor[sample_successor]
+
+    remaining = np.full(n, -1, dtype=np.int64)
+    index = sample_index[sample_of[:n]]
+    in_list = (sample_of[:n] >= 0) & (sample_successor[index] == samples.size)
+    remaining[in_list] = sample_remaining[index[in_list]] - offset[:n][in_list]
+    return remaining
+
+
+def _euler_tour(maze: Maze, start: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    """
+    Walk around the tree containing the start cell with one hand on the wall, which passes every passage once
+    in each direction. The successor of every passage is known locally, so the order of the walk is computed for all
+    passages at once with _rank_list.
+
+    :return: Tour position of every passage, passages encoded as 4 * cell id + direction of the passage from that
+    cell, their target cells, the id of the opposite passage, all in the same order, and a bool telling whether the
+    cells reached by the walk form a tree. Positions are -1 for passages the walk does not reach.
+    """
+    open_dirs = _open_directions(maze)
+    offsets = np.array([-maze.width, 1, maze.width, -1], dtype=np.int64)
+    passages = np.flatnonzero((open_dirs[:, None] >> np.arange(4)) & 1)
+    source, direction = np.divmod(passages, 4)
+    target = source + offsets[direction]
+    back = _OPPOSITE[direction]
+    # Dense index of every passage, so arrays only need one entry per passage
+    dense = np.full(open_dirs.size * 4, -1, dtype=np.int64)
+    dense[passages] = np.arange(passages.size)
+    opposite = dense[4 * target + back]
+
+    # After arriving at the target, leave by the next open direction clockwise from the way back.
+    # If the target is a dead end, that is the way back.
+    leave = back.copy()
+    target_open = open_dirs[target]
+    for turn in (3, 2, 1):
+        candidate = (back + turn) % 4
+        leave = np.where(target_open & (1 << candidate) != 0, candidate, leave)
+    successor = dense[4 * target + leave]
+
+    n = passages.size
+    position = np.full(n, -1, dtype=np.int64)
+    if not open_dirs[start]:
+        return position, target, opposite, True
+    first_direction = int(np.flatnonzero((int(open_dirs[start]) >> np.arange(4)) & 1)[0])
+    first = dense[4 * start + first_direction]
+    # Cut the cycle before the first passage, index n marks the end of the tour
+    successor = np.append(successor, n)
+    successor[successor == first] = n
+    remaining = _rank_list(successor, first)
+    in_tour = remaining >= 0
+    length = remaining[first]
+    position[in_tour] = length - remaining[in_tour]
+
+    # In a tree every passage of a reached cell is walked, otherwise the walk only went around a face of a cycle
+    reached = np.zeros(open_dirs.size, dtype=bool)
+    reached[start] = True
+    reached[target[in_tour]] = True
+    is_tree = np.count_nonzero(reached[source]) == length
+    return position, target, opposite, is_tree
+
+
+def _tree_distances(maze: Maze, start: int):
+    """
+    Distances from the start cell and the passage leading into every cell, computed from the Euler tour.
+
+    :return: Distance per flat cell id, -1 for unreachable cells, tour position per passage, opposite passage per
+    passage and the passage into every cell, -1 for the start cell and unreachable cells. None if the maze is not a
+    tree around the start cell.
+    """
+    position, target, opposite, is_tree = _euler_tour(maze, start)
+    if not is_tree:
+        return None
+    size = maze.width * maze.height
+    distance = np.full(size, -1, dtype=np.int64)
+    distance[start] = 0
+    entering = np.full(size, -1, dtype=np.int64)
+    in_tour = position >= 0
+    # A passage leads away from the start if it is walked before its opposite passage
+    down = in_tour & (position < np.where(in_tour, position[opposite], -1))
+    order = np.empty(np.count_nonzero(in_tour), dtype=np.int64)
+    order[position[in_tour]] = np.flatnonzero(in_tour)
+    depth = np.cumsum(np.where(down[order], 1, -1))
+    distance[target[down]] = depth[position[down]]
+    entering[target[down]] = np.flatnonzero(down)
+    return distance, position, opposite, entering
+
+
+def distance_field(maze: Maze, start: CellIndex = None) -> np.ndarray:
+    """
+    Compute the length of the shortest path from the start cell to every cell of the maze.
+    Perfect mazes are solved with an Euler tour in a fixed number of array operations. Mazes with loops fall back to
+    a breadth first search with one array operation per distance.
+
+    :param maze: The maze to solve
+    :param start: The cell to measure from, the start cell of the maze by default
+    :return: int64 array with shape (height, width), -1 for cells that can't be reached
+    """
+    start = _flat_id(maze, maze.start_cell if start is None else start)
+    tree = _tree_distances(maze, start)
+    distance = _frontier_distances(maze, start) if tree is None else tree[0]
+    return distance.reshape(maze.height, maze.width)
+
+
+def _path_from_distances(maze: Maze, distance: np.ndarray, end: int) -> np.ndarray:
+    """
+    Walk back from the end to the start along decreasing distance, one array operation per cell of the path.
+    """
+    open_dirs = _open_directions(maze)
+    offsets = (-maze.width, 1, maze.width, -1)
+    path = [end]
+    while distance[path[-1]] > 0:
+        cell = path[-1]
+        path.append(next(cell + offsets[direction] for direction in Direction
+                         if open_dirs[cell] & (1 << direction) and
+                         distance[cell + offsets[direction]] == distance[cell] - 1))
+    return np.array(path[::-1], dtype=np.int64)
+
+
+def _path(maze: Maze, start: int, end: int = None) -> np.ndarray:
+    """
+    Find the path from start to end, or to the cell farthest away from start if end is None.
+    """
+    tree = _tree_distances(maze, start)
+    distance = _frontier_distances(maze, start) if tree is None else tree[0]
+    if end is None:
+        end = int(np.argmax(distance))
+    if distance[end] < 0:
+        raise ValueError("The end cell can't be reached from the start cell.")
+    if tree is None:
+        return _path_from_distances(maze, distance, end)
+    if end == start:
+        return np.array([start], dtype=np.int64)
+    _, position, opposite, entering = tree
+    # A cell lies on the path to the end if the tour enters it before the end and leaves it after the end
+    reached_cells = np.flatnonzero(entering >= 0)
+    into = entering[reached_cells]
+    arrival = position[entering[end]]
+    on_path = (position[into] <= arrival) & (position[opposite[into]] > arrival)
+    path = reached_cells[on_path]
+    path = path[np.argsort(distance[path])]
+    return np.concatenate(([start], path))
+
+
+def shortest_path(maze: Maze, start: CellIndex = None, end: CellIndex = None) -> np.ndarray:
+    """
+    Find the shortest path between two cells. In a perfect maze this is the only path between them.
+
+    :param maze: The maze to solve
+    :param start: First cell of the path, the start cell of the maze by default
+    :param end: Last cell of the path, by default the cell farthest away from the start
+    :return: Flat cell ids (y * width + x) of the cells on the path, from start to end
+    """
+    start = _flat_id(maze, maze.start_cell if start is None else start)
+    return _path(maze, start, None if end is None else _flat_id(maze, end))
+
+
+def longest_path(maze: Maze) -> np.ndarray:
+    """
+    Find the longest shortest path within the part of the maze reachable from its start cell. It starts at the cell
+    farthest away from the start cell and ends at the cell farthest away from that one.
+
+    :param maze: The maze to solve
+    :return: Flat cell ids (y * width + x) of the cells on the path
+    """
+    return _path(maze, int(_path(maze, _flat_id(maze, maze.start_cell))[-1]))
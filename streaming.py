@@ -0,0 +1,187 @@
+import struct
+import zlib
+from typing import BinaryIO, Iterator
+
+import numpy as np
+
+from maze import Maze, MazeVisualizerPIL, CellIndex, Wall, ALL_WALLS, render_maze_array
+
+
+class PNGWriter:
+    """
+    Write a PNG image row by row, so the whole image never has to be held in memory.
+    Compressed image data is written out as IDAT chunks whenever enough of it has accumulated.
+    """
+    # PNG colour type and bytes per pixel for the supported image modes
+    _MODES = {"L": (0, 1), "RGB": (2, 3)}
+
+    def __init__(self, file: BinaryIO, width: int, height: int, mode: str = "RGB", compress_level: int = 6,
+                 chunk_size: int = 1 << 20):
+        """
+        Initialize the writer and write the PNG header.
+
+        :param file: Binary file object to write to
+        :param width: Width of the image in pixels
+        :param height: Height of the image in pixels, the number of rows that have to be written
+        :param mode: PIL image mode of the rows, "L" or "RGB"
+        :param compress_level: zlib compression level
+        :param chunk_size: Size in bytes of compressed data after which an IDAT chunk is written
+        """
+        if mode not in self._MODES:
+            raise ValueError(f"Unsupported mode {mode}, expected one of {', '.join(self._MODES)}.")
+        self.file = file
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.rows_written = 0
+        self._chunk_size = chunk_size
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+        colour_type, self._bytes_per_pixel = self._MODES[mode]
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def _flush_idat(self):
+        if self._pending_size:
+            self._write_chunk(b"IDAT", b"".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def _add_compressed(self, data: bytes):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+            if self._pending_size >= self._chunk_size:
+                self._flush_idat()
+
+    def write_rows(self, rows: np.ndarray):
+        """
+        Append pixel rows to the image.
+
+        :param rows: uint8 array with shape (rows, width) for mode "L" or (rows, width, 3) for mode "RGB"
+        """
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(-1, self.width * self._bytes_per_pixel)
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"Too many rows, the image has a height of {self.height}.")
+        # Every row starts with the filter type byte, 0 means no filter
+        filtered = np.zeros((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 1:] = rows
+        self._add_compressed(self._compressor.compress(filtered.tobytes()))
+        self.rows_written += len(rows)
+
+    def close(self):
+        """
+        Finish the image data and write the end of the PNG file. Does not close the file object.
+        """
+        if self.rows_written != self.height:
+            raise ValueError(f"Image is incomplete, {self.rows_written} of {self.height} rows were written.")
+        self._add_compressed(self._compressor.flush())
+        self._flush_idat()
+        self._write_chunk(b"IEND", b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+def eller_rows(width: int, height: int, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    """
+    Generate a perfect maze row by row with Eller's algorithm. Only the sets of the cells of the current row are
+    kept, so memory use depends on the width only.
+
+    :param width: The width of the maze in cells
+    :param height: The height of the maze in cells
+    :param rng: Random generator
+    :return: Iterator over the wall bitmask of every row, uint8 arrays of length width
+    """
+    # Set of every cell in the current row. Cells in the same set are connected by the rows above.
+    sets = np.arange(width)
+    open_north = np.zeros(width, dtype=bool)
+    for y in range(height):
+        last_row = y == height - 1
+        walls = np.full(width, ALL_WALLS, dtype=np.uint8)
+        walls[open_north] &= ~np.uint8(Wall.N)
+
+        # Join neighbours of different sets at random, the last row joins all of them
+        _, labels = np.unique(sets, return_inverse=True)
+        union_find = list(range(int(labels.max()) + 1))
+        join = (rng.random(width - 1) < 0.5).tolist()
+        open_east = np.zeros(width, dtype=bool)
+        labels = labels.tolist()
+        for x in range(width - 1):
+            a = labels[x]
+            while union_find[a] != a:
+                a = union_find[a]
+            b = labels[x + 1]
+            while union_find[b] != b:
+                b = union_find[b]
+            if a != b and (last_row or join[x]):
+                union_find[b] = a
+                open_east[x] = True
+        for x, label in enumerate(labels):
+            while union_find[label] != label:
+                label = union_find[label]
+            labels[x] = label
+        sets = np.array(labels)
+        walls[open_east] &= ~np.uint8(Wall.E)
+        walls[1:][open_east[:-1]] &= ~np.uint8(Wall.W)
+
+        if last_row:
+            yield walls
+            return
+        # Open passages south at random, but at least one per set so no set is cut off
+        key = rng.random(width)
+        order = np.lexsort((key, sets))
+        forced = order[np.append(sets[order][1:] != sets[order][:-1], True)]
+        open_north = rng.random(width) < 0.5
+        open_north[forced] = True
+        walls[open_north] &= ~np.uint8(Wall.S)
+        yield walls
+        # Cells without a passage to the row above start in a new set
+        sets = np.where(open_north, sets, width + np.arange(width))
+
+
+def stream_maze(file: BinaryIO, width: int, height: int, rng: np.random.Generator,
+                cell_size_pixels: int = 5, line_width_pixels: int = 1, start_cell_index: CellIndex = None):
+    """
+    Generate a maze with Eller's algorithm and write it as PNG, one row of cells at a time.
+    Output height is only limited by disk space, not by memory.
+
+    :param file: Binary file object to write the PNG image to
+    :param width: The width of the maze in cells
+    :param height: The height of the maze in cells
+    :param rng: Random generator
+    :param cell_size_pixels: The size of each cell in pixels
+    :param line_width_pixels: The width of the cell walls in pixels
+    :param start_cell_index: The cell colored as start, (0, 0) by default
+    """
+    if start_cell_index is None:
+        start_cell_index = CellIndex(x=0, y=0)
+    # Each row is rendered in a window of three rows, the previous row, the current row and an empty row below it.
+    # This way wall ends and walls wider than one pixel are drawn the same as in a plot of the whole maze.
+    window = Maze(width, 3)
+    window.visited[1, :] = True
+    palette = MazeVisualizerPIL(window, cell_size_pixels, line_width_pixels).palette
+    img_width = width * cell_size_pixels + 1
+    img_height = height * cell_size_pixels + 1
+    with PNGWriter(file, img_width, img_height, mode="RGB") as writer:
+        for y, walls in enumerate(eller_rows(width, height, rng)):
+            window.walls[0, :] = window.walls[1, :]
+            window.visited[0, :] = y > 0
+            window.walls[1, :] = walls
+            window.start_cell = CellIndex(x=start_cell_index.x, y=1)
+            indices = render_maze_array(window, cell_size_pixels, line_width_pixels,
+                                        color_start_cell=y == start_cell_index.y)
+            # The last row also contains the bottom border line
+            band_end = 2 * cell_size_pixels + (1 if y == height - 1 else 0)
+            writer.write_rows(palette[indices[cell_size_pixels:band_end]])
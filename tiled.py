@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from maze import Maze, CellIndex, ALGORITHMS, _label_components, _join_forest, _selected_cells, seed_to_int
+
+
+class SharedArray:
+    """
+    numpy array backed by shared memory, which other processes can attach to by name instead of receiving a pickled
+    copy.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype, name: str = None):
+        """
+        Create a new shared array or attach to an existing one.
+
+        :param shape: Shape of the array
+        :param dtype: numpy dtype of the array
+        :param name: Name of an existing shared array, None to create a new one
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def spec(self) -> Tuple[str, Tuple[int, ...], str]:
+        """
+        Return the arguments needed to attach to this array from another process.
+        """
+        return self.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+def _tiles(width: int, height: int, tile_size: int):
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield y, min(y + tile_size, height), x, min(x + tile_size, width)
+
+
+def _generate_tile(walls_spec, cells_spec, label_spec, bounds: Tuple[int, int, int, int], algorithm: str,
+                   seed: np.random.SeedSequence):
+    """
+    Generate a spanning forest of one tile, with one tree per connected component of the cells within the tile.
+    Runs in a worker process and writes the walls and the id of the tree of every cell into the shared arrays.
+    """
+    y0, y1, x0, x1 = bounds
+    shared = [SharedArray(shape, dtype, name) for name, shape, dtype in (walls_spec, cells_spec, label_spec)]
+    try:
+        walls, all_cells, label = (array.array for array in shared)
+        full_width = all_cells.shape[1]
+        cells = all_cells[y0:y1, x0:x1].copy()
+        tile = Maze(x1 - x0, y1 - y0, cells)
+        # Every component of the cells within the tile becomes a tree
+        start = np.flatnonzero(cells)
+        start = CellIndex(x=0, y=0) if not start.size else CellIndex(x=int(start[0] % tile.width),
+                                                                     y=int(start[0] // tile.width))
+        ALGORITHMS[algorithm](tile, cells, start, np.random.default_rng(seed))
+        walls[y0:y1, x0:x1] = tile.walls
+        if cells.all():
+            # Tiles without mask are a single tree
+            label[y0:y1, x0:x1] = y0 * full_width + x0
+        else:
+            tile_label = _label_components(tile, cells).reshape(cells.shape)
+            # Convert the tile local ids of the trees to global cell ids
+            global_label = (y0 + tile_label // tile.width) * full_width + x0 + tile_label % tile.width
+            label[y0:y1, x0:x1] = np.where(cells, global_label, -1)
+    finally:
+        for array in shared:
+            array.close()
+
+
+def generate_maze_tiled(width: int, height: int, start_cell_index: CellIndex = None, mask: np.ndarray = None,
+                        algorithm: str = "backtracker", seed: Union[int, str, None] = None, tile_size: int = 1024,
+                        workers: int = None, components: Union[str, List[CellIndex]] = "start") -> Maze:
+    """
+    Generate a maze in square tiles on a process pool. Every tile becomes a perfect maze of its own, then the tiles
+    are joined by opening one random passage per edge of a random spanning tree over the tiles, so the result is a
+    single perfect maze again. Walls are exchanged through shared memory.
+    The maze only depends on the seed and the tile size, not on the number of workers. Passages between tiles are
+    rarer than within them, which is visible in mazes with small tiles.
+
+    :param width: The width of the maze in cells
+    :param height: The height of the maze in cells
+    :param start_cell_index: The index of the start cell (default is (0, 0))
+    :param mask: An optional mask to apply to the maze
+    :param algorithm: Name of the generation algorithm used within the tiles, one of ALGORITHMS
+    :param seed: Integer or string seed making the maze reproducible
+    :param tile_size: Edge length of the tiles in cells
+    :param workers: Number of worker processes, all cores by default
+    :param components: Which connected components of the mask become a maze, see generate_maze
+    :return: The generated maze
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm {algorithm}, expected one of {', '.join(ALGORITHMS)}.")
+    if tile_size < 1:
+        raise ValueError("tile_size has to be at least 1.")
+    maze = Maze(width, height, mask)
+    if start_cell_index is None:
+        start_cell_index = CellIndex(x=0, y=0)
+    maze.start_cell = start_cell_index
+    maze.seed = seed
+    cells = _selected_cells(maze, start_cell_index, components)
+
+    tiles = list(_tiles(maze.width, maze.height, tile_size))
+    # Child seeds depend on the tile, not on the worker it runs on
+    tile_seeds = np.random.SeedSequence(None if seed is None else seed_to_int(seed)).spawn(len(tiles) + 1)
+    shared_walls = SharedArray(maze.walls.shape, np.uint8)
+    shared_cells = SharedArray(cells.shape, bool)
+    shared_label = SharedArray(cells.shape, np.int64)
+    try:
+        shared_walls.array[...] = maze.walls
+        shared_cells.array[...] = cells
+        specs = (shared_walls.spec(), shared_cells.spec(), shared_label.spec())
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = [executor.submit(_generate_tile, *specs, bounds, algorithm, tile_seed)
+                       for bounds, tile_seed in zip(tiles, tile_seeds)]
+            for future in futures:
+                future.result()
+        maze.walls[...] = shared_walls.array
+        label = shared_label.array.ravel().copy()
+    finally:
+        for array in (shared_walls, shared_cells, shared_label):
+            array.close()
+            array.unlink()
+    maze.visited[...] = cells
+    # Cells outside of the maze are their own tree, they have no edges in the join
+    parent = np.where(label >= 0, label, np.arange(label.size))
+    _join_forest(maze, cells, parent, np.random.default_rng(tile_seeds[-1]))
+    return maze
@@ -0,0 +1,156 @@
+import functools
+import json
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+from maze import Maze, Wall, MazeVisualizerPIL, render_maze_array, BACKGROUND
+from mazefile import MazeFile, save_maze
+
+# Deep zoom tiles of a maze saved on disk. At zoom level max_zoom a cell is cell_size pixels wide, every lower level
+# halves the size, until level 0 shows the whole maze in one tile. Levels in which cells are at least MIN_CELL_SIZE
+# pixels wide are rendered from the cells within the tile only. At smaller sizes single walls can't be drawn anymore,
+# those levels are cut from a gray overview pyramid that is computed once when the maze is saved.
+
+TILE_SIZE = 256
+MIN_CELL_SIZE = 2
+
+
+def max_zoom_level(width: int, height: int, cell_size: int) -> int:
+    """
+    Return the zoom level at which cells are cell_size pixels wide, if the whole maze fits into one tile at level 0.
+    """
+    return max(0, math.ceil(math.log2(max(width, height) * cell_size / TILE_SIZE)))
+
+
+def _overview(maze: Maze) -> np.ndarray:
+    """
+    Gray value of every cell, the fraction of its pixels that are not wall when plotted with 2 pixels per cell.
+    Of the 2 x 2 pixels the corner is always a wall, the north and west pixels if the cell has that wall.
+    """
+    walls = np.where(maze.visited, maze.walls, 0)
+    ink = np.where(maze.visited, 1 + (walls & Wall.N != 0) + (walls & Wall.W != 0), 0).astype(np.float32) / 4
+    if maze.mask is not None:
+        ink[~np.asarray(maze.mask, dtype=bool)] = 1
+    return np.round(255 * (1 - ink)).astype(np.uint8)
+
+
+def _halve(level: np.ndarray) -> np.ndarray:
+    height, width = level.shape
+    padded = np.pad(level, ((0, height % 2), (0, width % 2)), constant_values=255).astype(np.uint16)
+    return ((padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2] + 2) // 4).astype(
+        np.uint8)
+
+
+def save_tiled_maze(maze: Maze, directory: str, maze_id: str, cell_size: int = 16, line_width: int = 2) -> dict:
+    """
+    Save a maze with its overview pyramid, so open_tiled_maze can render its tiles. The description of the maze is
+    written last, so other processes only open completely saved mazes.
+
+    :param maze: The maze
+    :param directory: Directory in which the files of the maze are stored
+    :param maze_id: Name of the maze within the directory
+    :param cell_size: Size of a cell at the highest zoom level in pixels, a power of two
+    :param line_width: Width of the walls at the highest zoom level in pixels
+    :return: Description of the maze
+    """
+    if cell_size < MIN_CELL_SIZE or cell_size & (cell_size - 1):
+        raise ValueError(f"cell_size has to be a power of two of at least {MIN_CELL_SIZE}.")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, maze_id)
+    suffix = f".{os.getpid()}.tmp"
+    max_zoom = max_zoom_level(maze.width, maze.height, cell_size)
+    save_maze(maze, path + ".maze" + suffix)
+    os.replace(path + ".maze" + suffix, path + ".maze")
+    level = _overview(maze)
+    for zoom in range(max_zoom - int(math.log2(cell_size)), -1, -1):
+        # One pixel per cell at the first overview level, then half the size at every level
+        with open(path + f".{zoom}.npy" + suffix, "wb") as file:
+            np.save(file, level)
+        os.replace(path + f".{zoom}.npy" + suffix, path + f".{zoom}.npy")
+        level = _halve(level)
+    info = {"id": maze_id, "width": maze.width, "height": maze.height, "seed": maze.seed, "cell_size": cell_size,
+            "line_width": line_width, "max_zoom": max_zoom, "tile_size": TILE_SIZE}
+    with open(path + ".json" + suffix, "w") as file:
+        json.dump(info, file)
+    os.replace(path + ".json" + suffix, path + ".json")
+    return info
+
+
+def load_info(directory: str, maze_id: str) -> dict:
+    """
+    Return the description of a saved maze.
+
+    :raises FileNotFoundError: If the maze was not saved (yet)
+    """
+    with open(os.path.join(directory, maze_id + ".json")) as file:
+        return json.load(file)
+
+
+class TiledMaze:
+    """
+    A maze saved with save_tiled_maze. Only the cells and overview pixels within a tile are read to render it.
+    """
+
+    def __init__(self, directory: str, maze_id: str):
+        self.info = load_info(directory, maze_id)
+        self.path = os.path.join(directory, maze_id)
+        self.maze_file = MazeFile(self.path + ".maze")
+        self.palette = MazeVisualizerPIL(Maze(1, 1), 1, 1).palette.ravel().tolist()
+
+    def cell_size(self, zoom: int) -> float:
+        return self.info["cell_size"] * 2.0 ** (zoom - self.info["max_zoom"])
+
+    def tile_count(self, zoom: int) -> tuple:
+        """
+        Number of tiles in x and y direction at a zoom level.
+        """
+        cell_size = self.cell_size(zoom)
+        extra = 1 if cell_size >= MIN_CELL_SIZE else 0
+        return tuple(math.ceil((cells * cell_size + extra) / TILE_SIZE)
+                     for cells in (self.info["width"], self.info["height"]))
+
+    def tile(self, zoom: int, x: int, y: int) -> Image.Image:
+        """
+        Render a tile. Tiles at the right and bottom border are filled up with background.
+
+        :raises ValueError: If the tile is outside of the maze
+        """
+        if not 0 <= zoom <= self.info["max_zoom"]:
+            raise ValueError(f"Zoom level {zoom} does not exist.")
+        tiles_x, tiles_y = self.tile_count(zoom)
+        if not (0 <= x < tiles_x and 0 <= y < tiles_y):
+            raise ValueError(f"Tile {x}, {y} does not exist at zoom level {zoom}.")
+        if self.cell_size(zoom) < MIN_CELL_SIZE:
+            level = np.load(self.path + f".{zoom}.npy", mmap_mode="r")
+            pixels = np.full((TILE_SIZE, TILE_SIZE), 255, dtype=np.uint8)
+            part = level[y * TILE_SIZE:(y + 1) * TILE_SIZE, x * TILE_SIZE:(x + 1) * TILE_SIZE]
+            pixels[:part.shape[0], :part.shape[1]] = part
+            return Image.fromarray(pixels, mode="L")
+
+        size = int(self.cell_size(zoom))
+        line_width = max(1, self.info["line_width"] * size // self.info["cell_size"])
+        # Wide walls of the neighbouring cells reach into the tile
+        halo = 1 + line_width // size
+        x0, y0 = x * TILE_SIZE, y * TILE_SIZE
+        first_x, first_y = max(0, x0 // size - halo), max(0, y0 // size - halo)
+        last_x = min(self.info["width"], (x0 + TILE_SIZE) // size + 1 + halo)
+        last_y = min(self.info["height"], (y0 + TILE_SIZE) // size + 1 + halo)
+        indices = render_maze_array(self.maze_file.window(first_y, last_y, first_x, last_x), size, line_width)
+        part = indices[y0 - first_y * size:y0 - first_y * size + TILE_SIZE,
+                       x0 - first_x * size:x0 - first_x * size + TILE_SIZE]
+        pixels = np.full((TILE_SIZE, TILE_SIZE), BACKGROUND, dtype=np.uint8)
+        pixels[:part.shape[0], :part.shape[1]] = part
+        img = Image.fromarray(pixels, mode="P")
+        img.putpalette(self.palette)
+        return img
+
+
+@functools.lru_cache(maxsize=32)
+def open_tiled_maze(directory: str, maze_id: str) -> TiledMaze:
+    """
+    Open a saved maze. Opened mazes are cached, so their files are only mapped into memory once.
+    """
+    return TiledMaze(directory, maze_id)
@@ -0,0 +1,379 @@
+import atexit
+import bisect
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, the files of exited processes are not folded there
+    fcntl = None
+
+# Lightweight timing of the stages of generating a maze. Every stage is added to a histogram of the process and,
+# while a request is being timed, to the list of timings of the request, which the web app sends as Server-Timing
+# header. Histograms of all processes are merged through one JSON file per process in a shared directory, so
+# /metrics reports all gunicorn workers and pool processes.
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Seconds between two writes of the histograms of a process
+FLUSH_INTERVAL = 1.0
+# File in the metrics directory holding the histograms of all processes that exited
+AGGREGATE_FILE = "aggregate.json"
+
+_HELP = {
+    "mazemaker_stage_seconds": "Time spent in a stage of generating, rendering or encoding a maze.",
+    "mazemaker_request_seconds": "Time spent answering a request.",
+}
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_histograms = {}
+_lock = threading.Lock()
+_metrics_dir = None
+# Histograms changed since they were written
+_dirty = False
+_flusher_pid = None
+# Identifies the process in the name of its file, process ids alone are reused
+_process_id = f"{os.getpid()}-{time.time_ns()}"
+
+
+def _reset():
+    global _histograms, _lock, _dirty, _flusher_pid, _process_id
+    # Forked processes start with empty histograms, otherwise the parent's observations would be counted twice.
+    # The thread writing the histograms is not forked along.
+    _histograms = {}
+    _lock = threading.Lock()
+    _dirty = False
+    _flusher_pid = None
+    _process_id = f"{os.getpid()}-{time.time_ns()}"
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def enable_metrics(directory: str):
+    """
+    Write the histograms of this process and of processes forked from it to a file in directory, where
+    collect_metrics reads them.
+    """
+    global _metrics_dir
+    os.makedirs(directory, exist_ok=True)
+    _metrics_dir = directory
+
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Add a duration to a histogram.
+
+    :param name: Name of the histogram
+    :param seconds: Observed duration
+    :param labels: Labels of the histogram
+    """
+    global _dirty, _flusher_pid
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+        _dirty = True
+        start_flusher = _metrics_dir is not None and _flusher_pid != os.getpid()
+        if start_flusher:
+            _flusher_pid = os.getpid()
+    if start_flusher:
+        # atexit handlers don't run in the processes of a ProcessPoolExecutor, so every process writes its
+        # histograms in the background shortly after they changed
+        threading.Thread(target=_flush_periodically, daemon=True).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _dirty:
+            flush()
+
+
+def _snapshot() -> list:
+    with _lock:
+        return [[name, labels, [list(counts), total, count]]
+                for (name, labels), (counts, total, count) in _histograms.items()]
+
+
+def flush():
+    """
+    Write the histograms of this process to its file in the metrics directory.
+    """
+    global _dirty
+    if _metrics_dir is None:
+        return
+    _dirty = False
+    path = os.path.join(_metrics_dir, f"{_process_id}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(_snapshot(), file)
+    os.replace(tmp_path, path)
+
+
+atexit.register(flush)
+
+
+def _record(name: str, seconds: float):
+    observe("mazemaker_stage_seconds", seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+class stage:
+    """
+    Context manager timing a stage.
+
+    :param name: Name of the stage, used as label of the histogram and in the Server-Timing header
+    """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.perf_counter() - self.start)
+
+
+def timed(name: str):
+    """
+    Decorator timing every call of a function as a stage.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def start_request() -> contextvars.Token:
+    """
+    Start collecting the stages of a request in the current context.
+
+    :return: Token to pass to end_request
+    """
+    return _request_timings.set([])
+
+
+def request_timings() -> List[Tuple[str, float]]:
+    """
+    Return the name and duration in seconds of every stage timed so far during the current request.
+    """
+    return _request_timings.get() or []
+
+
+def add_request_timings(timings: List[Tuple[str, float]]):
+    """
+    Add stages timed in another process, like a process of a pool, to the timings of the current request. They are
+    not added to the histograms of this process, the other process has done so already.
+    """
+    current = _request_timings.get()
+    if current is not None:
+        current.extend(timings)
+
+
+def end_request(token: contextvars.Token):
+    """
+    Stop collecting the stages of a request.
+    """
+    _request_timings.reset(token)
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float = None) -> str:
+    """
+    Format timings as value of a Server-Timing header. Stages that ran several times are added up.
+    """
+    durations = collections.OrderedDict()
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in durations.items())
+
+
+def _format_labels(labels) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+@contextlib.contextmanager
+def _directory_lock(directory: str):
+    """
+    Hold an exclusive lock on the metrics directory, so only one collector at a time folds files.
+
+    :return: Context manager yielding False if locking is not supported
+    """
+    if fcntl is None:
+        yield False
+        return
+    with open(os.path.join(directory, "aggregate.lock"), "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _read_directory(directory: str) -> Dict[str, list]:
+    sources = {}
+    for filename in os.listdir(directory):
+        if filename.endswith(".json"):
+            try:
+                with open(os.path.join(directory, filename)) as file:
+                    sources[filename] = json.load(file)
+            except (OSError, ValueError):
+                # The file of a process that is just being replaced
+                continue
+    return sources
+
+
+def _exited(filename: str) -> bool:
+    """
+    Check if the process that wrote a histogram file has exited. The files of this process and the aggregate file
+    never count as exited.
+    """
+    try:
+        pid = int(filename.split("-", 1)[0])
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _merge(sources) -> dict:
+    merged = {}
+    for data in sources:
+        for name, labels, (counts, total, count) in data:
+            key = (name, tuple(tuple(label) for label in labels))
+            histogram = merged.setdefault(key, [[0] * (len(BUCKETS) + 1), 0.0, 0])
+            histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+            histogram[1] += total
+            histogram[2] += count
+    return merged
+
+
+def _fold_exited(directory: str, sources: Dict[str, list]):
+    """
+    Merge the files of exited processes into the aggregate file and remove them, so the directory does not grow with
+    every process that ever ran. Has to be called with the directory lock held.
+    """
+    exited = [filename for filename in sources if _exited(filename)]
+    if not exited:
+        return
+    merged = _merge([sources.get(AGGREGATE_FILE, [])] + [sources[filename] for filename in exited])
+    path = os.path.join(directory, AGGREGATE_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump([[name, labels, histogram] for (name, labels), histogram in merged.items()], file)
+    os.replace(tmp_path, path)
+    for filename in exited:
+        os.remove(os.path.join(directory, filename))
+
+
+def collect_metrics(directory: str = None) -> str:
+    """
+    Merge the histograms of all processes that wrote to the metrics directory and format them in the Prometheus text
+    format. The files of processes that exited are folded into one aggregate file, so counts never go down. The
+    directory may only be shared by processes on the same host, which can tell if the others are still running.
+
+    :param directory: Metrics directory, the one passed to enable_metrics by default
+    """
+    flush()
+    directory = directory or _metrics_dir
+    if directory is not None:
+        with _directory_lock(directory) as locked:
+            sources = _read_directory(directory)
+            if locked:
+                _fold_exited(directory, sources)
+        merged = _merge(sources.values())
+    else:
+        merged = _merge([_snapshot()])
+
+    lines = []
+    for name in sorted({name for name, _ in merged}):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), (counts, total, count) in sorted(merged.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{{{_format_labels(labels + (('le', le),))}}} {cumulative}")
+            lines.append(f"{name}_sum{{{_format_labels(labels)}}} {total}")
+            lines.append(f"{name}_count{{{_format_labels(labels)}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a single thread. A background thread records the call stack of the profiled thread at
+    a fixed interval, which costs little in the profiled thread, unlike tracing every call.
+    """
+
+    def __init__(self, interval: float = 0.001, thread_id: int = None):
+        """
+        :param interval: Seconds between two samples
+        :param thread_id: Thread to profile, the thread creating the profiler by default
+        """
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        """
+        Return the samples in the collapsed stack format, one line per stack with the number of samples, which is
+        read by flame graph tools.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
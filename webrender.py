@@ -0,0 +1,171 @@
+import functools
+import io
+import json
+import os
+import secrets
+from typing import List, Tuple
+
+from PIL import Image
+
+from maze import generate_maze, masked_maze, MazeVisualizerPIL, MazeVisualizerSVG
+from create_mask_image import text_mask
+from metrics import best_seed, candidate_seeds
+from solver import shortest_path, longest_path
+from tiles import load_info, save_tiled_maze
+from timing import end_request, request_timings, stage, start_request
+
+# Rendering for the web routes. All functions only depend on their arguments, so they can run in the web worker or
+# in a process pool, and their results can be cached by their arguments.
+
+IMAGE_FORMATS = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml"}
+
+
+def encode_image(img: Image.Image, image_format: str, compress_level: int, lossless: bool, quality: int) -> bytes:
+    """
+    Encode a raster image.
+    """
+    img_io = io.BytesIO()
+    with stage("encode"):
+        if image_format == 'png':
+            img.save(img_io, 'PNG', compress_level=compress_level)
+        else:
+            img.save(img_io, 'WEBP', lossless=lossless, quality=quality)
+    return img_io.getvalue()
+
+
+def solution_path(maze, solution: str):
+    """
+    Solve the maze as selected by the solution parameter, None, "shortest" or "longest".
+    """
+    if solution is None:
+        return None
+    with stage("solve"):
+        return longest_path(maze) if solution == 'longest' else shortest_path(maze)
+
+
+def encode_maze(maze, cell_size: int, wall_width: int, image_format: str, mode: str, solution: str = None,
+                **encoder) -> bytes:
+    """
+    Plot the maze and encode it in the given format.
+    """
+    path = solution_path(maze, solution)
+    if image_format == 'svg':
+        with stage("svg"):
+            return "".join(MazeVisualizerSVG(maze, cell_size, wall_width).iter_svg(path=path)).encode()
+    vis = MazeVisualizerPIL(maze, cell_size, wall_width, mode)
+    vis.plot_walls(path=path)
+    return encode_image(vis.img, image_format, **encoder)
+
+
+def build_candidate(kind: str, params: dict, seed):
+    """
+    Generate the maze described by the parameters of the maze or masked_maze route with the given seed.
+    """
+    if kind == 'maze':
+        return generate_maze(params['width'], params['height'], algorithm=params['algorithm'], seed=seed)
+    return masked_maze(params['text'], params['fontsize'], params['bordersize'], params['algorithm'], seed,
+                       params['all_components'])
+
+
+def best_candidate_seed(kind: str, params: dict, executor=None, timeout: float = None) -> str:
+    """
+    Return the seed of the best of params['best_of'] candidates by params['score']. The candidates are derived from
+    the seed of the request, so the same request always selects the same maze.
+
+    :param executor: Executor scoring the candidates in parallel, by default they are scored in this process
+    :param timeout: Seconds after which to give up waiting for the executor
+    """
+    seed = params['seed'] if params['seed'] is not None else str(secrets.randbelow(2 ** 63))
+    with stage("candidates"):
+        seed, _ = best_seed(functools.partial(build_candidate, kind, params),
+                            candidate_seeds(seed, params['best_of']), params['score'], executor, timeout)
+    return seed
+
+
+def build_maze(kind: str, params: dict):
+    """
+    Generate the maze described by the parameters of the maze or masked_maze route.
+    """
+    seed = params['seed']
+    if params.get('best_of', 1) > 1:
+        seed = best_candidate_seed(kind, params)
+    return build_candidate(kind, params, seed)
+
+
+def render_maze(width, height, cell_size, wall_width, algorithm, seed, best_of=1, score="publishing",
+                **output) -> bytes:
+    maze = build_maze('maze', dict(width=width, height=height, algorithm=algorithm, seed=seed, best_of=best_of,
+                                   score=score))
+    return encode_maze(maze, cell_size, wall_width, **output)
+
+
+def render_masked_maze(text, fontsize, bordersize, cell_size, wall_width, algorithm, seed, all_components,
+                       best_of=1, score="publishing", **output) -> bytes:
+    maze = build_maze('masked_maze', dict(text=text, fontsize=fontsize, bordersize=bordersize, algorithm=algorithm,
+                                          seed=seed, all_components=all_components, best_of=best_of, score=score))
+    return encode_maze(maze, cell_size, wall_width, **output)
+
+
+def render_mask(text, fontsize, bordersize, image_format, mode, **encoder) -> bytes:
+    return encode_image(text_mask(text, fontsize, bordersize), image_format, **encoder)
+
+
+def render_tiles(width, height, algorithm, seed, cell_size, line_width, directory, maze_id) -> bytes:
+    """
+    Generate a maze and save it for the tile routes, unless it was saved before.
+
+    :return: Description of the saved maze as JSON
+    """
+    try:
+        info = load_info(directory, maze_id)
+    except FileNotFoundError:
+        maze = generate_maze(width, height, algorithm=algorithm, seed=seed)
+        info = save_tiled_maze(maze, directory, maze_id, cell_size, line_width)
+    return json.dumps(info).encode()
+
+
+RENDERERS = {'maze': render_maze, 'masked_maze': render_masked_maze, 'mask': render_mask, 'tiles': render_tiles}
+
+
+def render(kind: str, params: dict) -> bytes:
+    """
+    Render the response of a route from its parsed parameters.
+
+    :param kind: Name of the route, one of RENDERERS
+    :param params: Parsed query parameters of the route
+    :return: Encoded image
+    """
+    return RENDERERS[kind](**params)
+
+
+def render_timed(kind: str, params: dict) -> Tuple[bytes, List[Tuple[str, float]]]:
+    """
+    Render like render and also return the timed stages, so a web worker rendering in a process pool can report
+    the stages of the pool process.
+
+    :return: Encoded image and the name and duration in seconds of every stage
+    """
+    token = start_request()
+    try:
+        return render(kind, params), request_timings()
+    finally:
+        end_request(token)
+
+
+def run_job(kind: str, params: dict, result_path: str) -> bytes:
+    """
+    Render a job and store the result at result_path, so any web worker can serve it.
+    Files are written under a temporary name and renamed, so readers never see partial results. If rendering fails,
+    the error message is stored at result_path + ".error".
+    """
+    try:
+        data = render(kind, params)
+    except Exception as e:
+        with open(result_path + ".error", "w") as file:
+            json.dump({"error": str(e)}, file)
+        raise
+    tmp_path = f"{result_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, result_path)
+    return data